@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Controller micro-benchmarks (Lab 2)
+-----------------------------------
+Offline harness for rr_lb.py. Needs ryu installed, but no Mininet or root.
+
+- decode: packet_in decoding rate of the struct fast path vs the full
+  ryu packet parser.
+- replay: drives RoundRobinLB with fake datapaths that record every
+  message the controller sends, replays a synthetic or recorded (pcap)
+  PacketIn stream and reports handler throughput, per-event latency
+  percentiles, message counts and decision correctness.
+
+    python3 bench_rr_lb.py decode -n 200000
+    python3 bench_rr_lb.py replay -n 50000 --rate 5000
+    python3 bench_rr_lb.py replay --pcap trace.pcap --dpid 2 --in-port 1
+    python3 bench_rr_lb.py replay --set lb_policy=p2c --set lb_match=five_tuple
+"""
+
+import argparse
+import random
+import sys
+import time
+from collections import Counter
+
+from ryu import cfg
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.lib import pcaplib
+from ryu.lib.packet import packet, ethernet, ether_types, ipv4, tcp, in_proto
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+import rr_lb
+from rr_lb import RoundRobinLB, parse_headers, parse_headers_full
+
+
+# -------------------------------
+# Synthetic packets
+# -------------------------------
+def make_tcp_frame(src_ip="10.0.0.1", dst_ip="10.0.0.2", src_port=40000, dst_port=5001,
+                   src_mac="00:00:00:00:00:01", dst_mac="00:00:00:00:00:02"):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=dst_mac, src=src_mac,
+                                       ethertype=ether_types.ETH_TYPE_IP))
+    pkt.add_protocol(ipv4.ipv4(src=src_ip, dst=dst_ip, proto=in_proto.IPPROTO_TCP))
+    pkt.add_protocol(tcp.tcp(src_port=src_port, dst_port=dst_port, bits=tcp.TCP_SYN))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+def synthetic_stream(n, hosts=16, seed=1):
+    """PacketIns for new TCP flows arriving at an aggregation switch.
+
+    Sources enter on the uplink ports and are learned; destinations are
+    drawn from a disjoint set of hosts that never send, so every event is
+    an unknown-destination decision for the uplink selection policy.
+    """
+    rng = random.Random(seed)
+    dpid = rr_lb.AGGREGATION_SWITCHES[0]
+    frames = {}
+    for _ in range(n):
+        s, d = rng.randrange(hosts), rng.randrange(hosts)
+        sport = rng.randrange(32768, 61000)
+        key = (s, d, sport & 0xFF)
+        if key not in frames:
+            frames[key] = make_tcp_frame(src_ip=f"10.0.1.{s + 1}", dst_ip=f"10.0.2.{d + 1}",
+                                         src_port=sport,
+                                         src_mac=f"00:00:00:00:01:{s + 1:02x}",
+                                         dst_mac=f"00:00:00:00:02:{d + 1:02x}")
+        in_port = rr_lb.UPLINK_PORTS[s % len(rr_lb.UPLINK_PORTS)]
+        yield dpid, in_port, frames[key]
+
+def pcap_stream(path, dpid, in_port):
+    with open(path, "rb") as f:
+        for _, buf in pcaplib.Reader(f):
+            yield dpid, in_port, bytes(buf)
+
+# -------------------------------
+# Fake switches
+# -------------------------------
+class FakeDatapath:
+    """Stands in for a connected switch: builds real OpenFlow 1.3 message
+    objects through the normal parser, but only records them instead of
+    serializing and sending them."""
+    ofproto = ofproto_v1_3
+    ofproto_parser = ofproto_v1_3_parser
+
+    def __init__(self, dpid):
+        self.id = dpid
+        self.sent = []
+
+    def send_msg(self, msg):
+        self.sent.append(msg)
+
+def connect(app, datapaths, dpid):
+    dp = datapaths[dpid] = FakeDatapath(dpid)
+    features = ofproto_v1_3_parser.OFPSwitchFeatures(dp)
+    app.switch_features_handler(ofp_event.EventOFPSwitchFeatures(features))
+    state = ofp_event.EventOFPStateChange(dp)
+    state.state = MAIN_DISPATCHER
+    app._state_change_handler(state)
+    return dp
+
+def make_packet_in(dp, in_port, data):
+    parser = dp.ofproto_parser
+    msg = parser.OFPPacketIn(dp, buffer_id=dp.ofproto.OFP_NO_BUFFER, total_len=len(data),
+                             reason=dp.ofproto.OFPR_NO_MATCH, table_id=0, cookie=0,
+                             match=parser.OFPMatch(in_port=in_port), data=data)
+    return ofp_event.EventOFPPacketIn(msg)
+
+# -------------------------------
+# Replay
+# -------------------------------
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return float("nan")
+    idx = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+def replay(app, stream, rate=None):
+    """Feeds the stream to the handler, paced at `rate` events/s if given.
+
+    Returns per-event handler latencies (ns), wall time and the expected
+    MAC table (last in_port seen per source MAC on each switch).
+    """
+    datapaths, latencies, expected = {}, [], {}
+    handler = app._packet_in_handler
+    interval = 1.0 / rate if rate else 0.0
+    t0 = time.perf_counter()
+    for i, (dpid, in_port, data) in enumerate(stream):
+        dp = datapaths.get(dpid) or connect(app, datapaths, dpid)
+        ev = make_packet_in(dp, in_port, data)
+        if interval:
+            # Open-loop pacing: wait for the scheduled send time of event i
+            while time.perf_counter() < t0 + i * interval:
+                pass
+        start = time.perf_counter_ns()
+        handler(ev)
+        latencies.append(time.perf_counter_ns() - start)
+        hdr = parse_headers_full(data)
+        expected[(dpid, hdr.eth_src)] = in_port
+    return datapaths, latencies, time.perf_counter() - t0, expected
+
+def check_decisions(app, datapaths, expected):
+    """Returns a list of human-readable correctness problems (empty if none)."""
+    problems = []
+    for (dpid, mac), port in expected.items():
+        learned = app.mac_to_port.get(dpid, {}).get(mac)
+        if learned != port:
+            problems.append(f"dpid {dpid}: {mac} learned on {learned}, expected {port}")
+
+    if app.policy == "rr" and not app.use_groups:
+        for dpid, dp in datapaths.items():
+            split = uplink_split(app, dp)
+            if split and max(split.values()) - min(split.values()) > 1:
+                problems.append(f"dpid {dpid}: round robin split is uneven {dict(split)}")
+    return problems
+
+def uplink_split(app, dp):
+    """Counts how often each uplink was chosen in the PacketOuts sent to dp."""
+    split = Counter()
+    uplinks = app.uplinks.get(dp.id, [])
+    for msg in dp.sent:
+        if isinstance(msg, ofproto_v1_3_parser.OFPPacketOut):
+            for action in msg.actions:
+                port = getattr(action, "port", None)
+                if port in uplinks:
+                    split[port] += 1
+    return split
+
+def cmd_replay(args):
+    conf_args = ["--config-file", args.config_file] if args.config_file else []
+    cfg.CONF(args=conf_args, project="ryu")
+    for item in args.set:
+        key, _, value = item.partition("=")
+        cfg.CONF.set_override(key, value)
+
+    app = RoundRobinLB()
+    if args.pcap:
+        stream = pcap_stream(args.pcap, args.dpid, args.in_port)
+    else:
+        stream = synthetic_stream(args.n, hosts=args.hosts, seed=args.seed)
+    datapaths, latencies, wall, expected = replay(app, stream, args.rate)
+
+    n = len(latencies)
+    if n == 0:
+        # e.g. an empty pcap: nothing to time, and the rates below would divide by zero
+        print("[Replay] no events")
+        return 0
+    lat = sorted(latencies)
+    busy = sum(latencies) / 1e9
+    counts = Counter(type(m).__name__ for dp in datapaths.values() for m in dp.sent)
+    print(f"[Replay] events={n} wall={wall:.3f}s policy={app.policy} match={app.match_mode}")
+    print(f"[Replay] handler throughput: {n / busy:,.0f} packet_in/s "
+          f"(offered {n / wall:,.0f}/s)")
+    print("[Replay] latency us: " + "  ".join(
+        f"p{p}={percentile(lat, p) / 1e3:.1f}" for p in (50, 90, 99, 99.9))
+        + f"  max={lat[-1] / 1e3:.1f}")
+    print("[Replay] messages: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    for dpid, dp in sorted(datapaths.items()):
+        split = uplink_split(app, dp)
+        if split:
+            print(f"[Replay] dpid {dpid} uplink split: {dict(sorted(split.items()))}")
+
+    for name, tables in app.table_stats().items():
+        for dpid, st in sorted(tables.items()):
+            print(f"[Replay] dpid {dpid} {name}: " + ", ".join(f"{k}={v}" for k, v in st.items()))
+
+    problems = check_decisions(app, datapaths, expected)
+    for p in problems[:20]:
+        print(f"[Check] FAIL {p}")
+    print(f"[Check] {'OK' if not problems else f'{len(problems)} problem(s)'}")
+    return 1 if problems else 0
+
+# -------------------------------
+# Decoder benchmark
+# -------------------------------
+def bench_decode(decoder, frames, n):
+    start = time.perf_counter()
+    for i in range(n):
+        decoder(frames[i % len(frames)])
+    return n / (time.perf_counter() - start)
+
+def cmd_decode(args):
+    frames = [make_tcp_frame(src_port=40000 + i) for i in range(64)]
+    # Both decoders must agree before their speed is worth comparing
+    for f in frames:
+        assert parse_headers(f) == parse_headers_full(f), f
+
+    full = bench_decode(parse_headers_full, frames, args.n)
+    fast = bench_decode(parse_headers, frames, args.n)
+    print(f"[Decode] full ryu parser : {full:12,.0f} packet_in/s")
+    print(f"[Decode] fast path       : {fast:12,.0f} packet_in/s  ({fast / full:.1f}x)")
+    return 0
+
+# -------------------------------
+# Main
+# -------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Offline benchmarks for rr_lb.py")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    dec = sub.add_parser("decode", help="packet_in decoding benchmark")
+    dec.add_argument("-n", type=int, default=100_000, help="packet_ins to decode per decoder")
+    dec.set_defaults(func=cmd_decode)
+
+    rep = sub.add_parser("replay", help="drive RoundRobinLB with PacketIn events")
+    rep.add_argument("-n", type=int, default=20_000, help="synthetic events to replay")
+    rep.add_argument("--rate", type=float, help="offered events/s (default: as fast as possible)")
+    rep.add_argument("--hosts", type=int, default=16, help="synthetic source/destination hosts")
+    rep.add_argument("--seed", type=int, default=1)
+    rep.add_argument("--pcap", help="replay the frames of a pcap file instead")
+    rep.add_argument("--dpid", type=int, default=rr_lb.AGGREGATION_SWITCHES[0],
+                     help="switch the pcap frames arrive at")
+    rep.add_argument("--in-port", type=int, default=rr_lb.UPLINK_PORTS[0],
+                     help="ingress port of the pcap frames")
+    rep.add_argument("--config-file", help="ryu config file with lb_* options")
+    rep.add_argument("--set", action="append", default=[], metavar="OPT=VALUE",
+                     help="override an lb_* option, may be repeated")
+    rep.set_defaults(func=cmd_replay)
+
+    args = ap.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,39 @@
 Lab 2 Experiment Script
 -----------------------
 Creates a one-pod fat-tree topology (4 hosts, 4 switches)
+or a k-ary fat-tree (k^3/4 hosts, 5k^2/4 switches)
 and generates WebSearch & DataMining traffic using iperf.
 Uses static ARP, logs Flow Completion Times (FCT),
 and produces plots and summary statistics.
+Flow completions are event-driven (pidfd/selectors) and timestamped
+with the monotonic clock the moment each iperf client exits.
+With --generator agent, flows run on long-lived traffic_agent.py
+processes (one source per host, one sink per destination) instead.
+Flow arrivals come from an ArrivalScheduler: per-second bursts (the
+original behaviour), constant-rate, Poisson or a replayed trace, with
+rates given in flows/s or as a fraction of link capacity.
+With --matrix, every run drives a whole traffic matrix (permutation,
+all-to-all, incast or hotspot) concurrently instead of a single pair.
+Flow records are written in batches by a background thread, as JSONL,
+NumPy .npz chunks or Parquet (--log-format). FCT statistics are kept as
+streaming histograms (fct_stats.py), so no run is loaded back into memory.
+With --telemetry, switch port counters, queue backlog and flow tables are
+sampled during the run (telemetry.py) and joined onto the flow records.
 """
 
-import os, json, time, random
+import os, sys, json, time, random, argparse, selectors, threading, queue, itertools, subprocess, heapq, math, glob, atexit, signal
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
+from flow_dists import FlowSizeDist, INTERP_MODES, load_dist
+from fct_stats import FCTStats
+import telemetry
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:     # only needed for --log-format parquet
+    pa = pq = None
 from mininet.topo import Topo
 from mininet.net import Mininet
 from mininet.node import OVSSwitch, RemoteController
@@ -21,10 +45,14 @@ from mininet.log import setLogLevel
 # -------------------------------
 # Topology
 # -------------------------------
+def switch_opts(i):
+    """Pins the DPID to the switch number, so a name prefix cannot change it."""
+    return dict(dpid=f"{i:016x}")
+
 class OnePodFatTree(Topo):
-    def build(self):
-        h1, h2, h3, h4 = [self.addHost(f'h{i}') for i in range(1, 5)]
-        s1, s2, s3, s4 = [self.addSwitch(f's{i}') for i in range(1, 5)]
+    def build(self, prefix=""):
+        h1, h2, h3, h4 = [self.addHost(f'{prefix}h{i}') for i in range(1, 5)]
+        s1, s2, s3, s4 = [self.addSwitch(f'{prefix}s{i}', **switch_opts(i)) for i in range(1, 5)]
         opts = dict(bw=20, delay='1ms', use_htb=True)
         self.addLink(h1, s1, **opts)
         self.addLink(h2, s1, **opts)
@@ -36,130 +64,681 @@ class OnePodFatTree(Topo):
         self.addLink(s3, s4, **opts)
         print("[TOPO] One-Pod FatTree built successfully")
 
+class FatTree(Topo):
+    """k-ary fat-tree: k pods of k/2 edge and k/2 aggregation switches,
+    (k/2)^2 core switches and k/2 hosts per edge switch.
+    Switches are numbered s1.. (edge, then aggregation, then core) so
+    their DPIDs follow the numbers. `prefix` goes in front of every node
+    name so several networks can share one machine."""
+    def build(self, k=4, prefix=""):
+        if k < 2 or k % 2:
+            raise ValueError(f"fat-tree arity k must be even and >= 2, got {k}")
+        half = k // 2
+        opts = dict(bw=20, delay='1ms', use_htb=True)
+        n = iter(range(1, 5 * k * k // 4 + 1))
+        switch = lambda i: self.addSwitch(f'{prefix}s{i}', **switch_opts(i))
+        edges = [[switch(next(n)) for _ in range(half)] for _ in range(k)]
+        aggs = [[switch(next(n)) for _ in range(half)] for _ in range(k)]
+        cores = [switch(next(n)) for _ in range(half * half)]
+
+        h = 0
+        for pod in range(k):
+            for e, edge in enumerate(edges[pod]):
+                for _ in range(half):
+                    h += 1
+                    self.addLink(self.addHost(f'{prefix}h{h}'), edge, **opts)
+                for agg in aggs[pod]:
+                    self.addLink(edge, agg, **opts)
+            # Aggregation switch i of every pod connects to core group i
+            for i, agg in enumerate(aggs[pod]):
+                for core in cores[i * half:(i + 1) * half]:
+                    self.addLink(agg, core, **opts)
+        print(f"[TOPO] k={k} FatTree built successfully ({h} hosts, {5 * k * k // 4} switches)")
+
+# -------------------------------
+# Flow size distributions
+# -------------------------------
+TYPE_DISTS = {1: "websearch", 2: "datamining"}
+
+def get_sampler(t, seed=None, dist=None):
+    """Batch-drawing size sampler for traffic type t (1=WebSearch, 2=DataMining);
+    `dist` (a FlowSizeDist) replaces the built-in ECDF of that type."""
+    return (dist or FlowSizeDist.builtin(TYPE_DISTS[t])).sampler(seed)
+
 # -------------------------------
-# ECDF distributions
+# Arrival scheduling
 # -------------------------------
-WEBSEARCH_ECDF = [(10_000,0.10),(20_000,0.30),(35_000,0.60),
-                  (50_000,0.90),(80_000,0.95),(100_000,1.0)]
-DATAMINING_ECDF = [
-    (50_000,      0.10),  # 50 KB    → 10% of flows are ≤ 50 KB
-    (100_000,     0.20),  # 100 KB   → 20% of flows are ≤ 100 KB
-    (250_000,     0.30),  # 250 KB   → 30% of flows are ≤ 250 KB
-    (500_000,     0.40),  # 500 KB   → 40% of flows are ≤ 500 KB
-    (1_000_000,   0.60),  # 1 MB     → 60% of flows are ≤ 1 MB
-    (2_000_000,   0.70),  # 2 MB     → 70% of flows are ≤ 2 MB
-    (5_000_000,   0.80),  # 5 MB     → 80% of flows are ≤ 5 MB
-    (10_000_000,  1.00),  # 10 MB    → 100% of flows are ≤ 10 MB (max)
-]
+ARRIVAL_MODES = ("burst", "constant", "poisson", "trace")
+
+class ArrivalScheduler:
+    """Open-loop flow arrival times for one genDCTraffic run.
+
+    - burst:    `rate` flows launched together at every whole second
+                (the original genDCTraffic behaviour); a fractional rate
+                carries its remainder over, so 0.4 flows/s bursts one flow
+                in 2 or 3 seconds
+    - constant: one flow every 1/rate seconds
+    - poisson:  exponential inter-arrival times with mean 1/rate
+    - trace:    offsets (and optional sizes) replayed from a JSONL file with
+                lines like {"t": 0.0123, "size": 35000}
+
+    `load` (fraction of `link_bps`) can replace `rate`; it is converted with
+    the mean flow size. Pending arrivals sit in a timer heap; every launch
+    is recorded against its scheduled time so drift() shows when the
+    generator itself cannot keep up.
+    """
+    SPIN_S = 0.0005     # busy-wait the last 0.5 ms: selector timeouts only have ms resolution
+
+    def __init__(self, mode="burst", rate=None, load=None, mean_size=None,
+                 link_bps=20e6, trace=None, seed=None):
+        if mode not in ARRIVAL_MODES:
+            raise ValueError(f"arrival mode must be one of {ARRIVAL_MODES}, got {mode!r}")
+        if load is not None:
+            rate = load * link_bps / (8 * mean_size)
+        if mode != "trace" and not rate:
+            raise ValueError(f"{mode} arrivals need a rate or a load")
+        if mode == "trace" and not trace:
+            raise ValueError("trace arrivals need a trace file")
+        self.mode, self.rate, self.load = mode, rate, load
+        self.rng = random.Random(seed)
+        self.trace = trace
+        self.heap = []                  # (offset s, seq, size or None)
+        self.lags = []                  # launch time - scheduled time (s)
+        self._seq = itertools.count()
+
+    def tags(self):
+        tags = {"arrival": self.mode}
+        if self.load is not None:
+            tags["load"] = self.load
+        return tags
+
+    def start(self, duration):
+        self.duration = duration
+        self.heap.clear()
+        self._credit = 0.0              # burst mode: unsent fraction of a flow
+        self._k = 0                     # constant mode: index of the next arrival
+        if self.mode == "trace":
+            with open(self.trace) as f:
+                rows = [json.loads(l) for l in f if l.strip()]
+            self.heap = [(r["t"], next(self._seq), r.get("size")) for r in rows if r["t"] < duration]
+            heapq.heapify(self.heap)
+        else:
+            self._push_after(None)
+
+    def _push_after(self, offset):
+        """Schedules the arrival(s) following `offset` (None = the first)."""
+        if self.mode == "burst":
+            t = 0.0 if offset is None else math.floor(offset) + 1.0
+            while t < self.duration:
+                self._credit += self.rate
+                n = int(self._credit + 1e-9)
+                self._credit -= n
+                if n:
+                    for _ in range(n):
+                        heapq.heappush(self.heap, (t, next(self._seq), None))
+                    return
+                t += 1.0
+            return
+        if self.mode == "constant":
+            # k / rate rather than a running sum of 1 / rate, which gains an extra flow from rounding
+            t = self._k / self.rate
+            self._k += 1
+        else:
+            t = (0.0 if offset is None else offset) + self.rng.expovariate(self.rate)
+        if t < self.duration:
+            heapq.heappush(self.heap, (t, next(self._seq), None))
+
+    def next_due(self):
+        """Offset (s) of the next arrival, or None when the schedule is exhausted."""
+        return self.heap[0][0] if self.heap else None
 
-def sample_from_ecdf(ecdf):
-    r = random.random()
-    for v, p in ecdf:
-        if r <= p:
-            return v
-    return ecdf[-1][0]
+    def pop(self, now_offset):
+        """Removes and returns the size (or None) of the next arrival, recording its lag."""
+        t, _, size = heapq.heappop(self.heap)
+        self.lags.append(now_offset - t)
+        # Burst mode schedules a whole second at once; refill when its last flow leaves
+        if self.mode != "trace" and (self.mode != "burst" or not self.heap):
+            self._push_after(t)
+        return size, now_offset - t
 
-def get_sampler(t):
-    return (lambda: sample_from_ecdf(WEBSEARCH_ECDF)) if t==1 else (lambda: sample_from_ecdf(DATAMINING_ECDF))
+    def drift(self):
+        if not self.lags:
+            return {"launched": 0}
+        lags = sorted(self.lags)
+        pick = lambda q: lags[min(len(lags) - 1, int(q * len(lags)))]
+        return {"launched": len(lags), "mean_ms": 1e3 * sum(lags) / len(lags),
+                "p50_ms": 1e3 * pick(0.5), "p99_ms": 1e3 * pick(0.99), "max_ms": 1e3 * lags[-1]}
+
+# -------------------------------
+# Flow completion tracking
+# -------------------------------
+class FlowReaper:
+    """Reports flow processes as they exit instead of polling them.
+
+    Each process is watched through a pidfd (Linux >= 5.3) registered with a
+    selector, so wait() wakes up as soon as any flow finishes and stamps it
+    with time.monotonic_ns(). Where pidfd_open is unavailable a waiter thread
+    per process does the same and wakes the selector through a pipe.
+    """
+    def __init__(self):
+        self.sel = selectors.DefaultSelector()
+        self.pending = 0
+        self._done = []                         # completions reported by waiter threads
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        self.sel.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def __len__(self):
+        return self.pending
+
+    def add(self, fid, proc):
+        self.pending += 1
+        try:
+            fd = os.pidfd_open(proc.pid)
+        except (AttributeError, OSError):
+            threading.Thread(target=self._wait_thread, args=(fid, proc), daemon=True).start()
+            return
+        self.sel.register(fd, selectors.EVENT_READ, (fid, proc))
+
+    def _wait_thread(self, fid, proc):
+        proc.wait()
+        end_ns = time.monotonic_ns()
+        with self._lock:
+            self._done.append((fid, end_ns))
+        os.write(self._wake_w, b"x")
+
+    def wait(self, timeout=None):
+        """Blocks up to `timeout` seconds; returns [(fid, start_ns, end_ns)] of exited
+        flows. start_ns is None: the launch time recorded by the caller is used."""
+        done = []
+        for key, _ in self.sel.select(timeout):
+            if key.data is None:
+                try:
+                    os.read(self._wake_r, 4096)
+                except BlockingIOError:
+                    pass
+                continue
+            end_ns = time.monotonic_ns()
+            fid, proc = key.data
+            self.sel.unregister(key.fd)
+            os.close(key.fd)
+            proc.wait()                         # reap the zombie; it has already exited
+            done.append((fid, None, end_ns))
+        with self._lock:
+            done.extend((fid, None, end_ns) for fid, end_ns in self._done)
+            self._done.clear()
+        self.pending -= len(done)
+        return done
+
+    def close(self):
+        for key in list(self.sel.get_map().values()):
+            self.sel.unregister(key.fd)
+            os.close(key.fd)
+        self.sel.close()
+        os.close(self._wake_w)
+
+# -------------------------------
+# Traffic agents
+# -------------------------------
+AGENT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traffic_agent.py")
+SINK_PORT = 5101
+
+class TrafficAgent:
+    """Controls one `traffic_agent.py source` process on a Mininet host.
+
+    Flow requests go to the agent's stdin; a reader thread routes each
+    completion line back to the AgentFlows that launched it, so several
+    generators can share one agent concurrently.
+    """
+    def __init__(self, host, workers=64):
+        self.host = host
+        self.proc = host.popen([sys.executable, AGENT_SCRIPT, "source", "--workers", str(workers)],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, universal_newlines=True)
+        self._ids = itertools.count(1)
+        self._routes = {}                      # agent flow id -> (AgentFlows, caller's flow id)
+        self._lock = threading.Lock()
+        self._exited = False
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def send(self, flows, fid, dst_ip, port, size):
+        gid = next(self._ids)
+        with self._lock:
+            if self._exited:
+                raise RuntimeError(f"traffic agent on {self.host.name} exited")
+            self._routes[gid] = (flows, fid)
+            self.proc.stdin.write(json.dumps({"id": gid, "dst": dst_ip, "port": port,
+                                              "size": size}) + "\n")
+            self.proc.stdin.flush()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            result = json.loads(line)
+            with self._lock:
+                flows, fid = self._routes.pop(result["id"])
+            if result["ok"]:
+                flows.q.put((fid, result["start_ns"], result["end_ns"]))
+            else:
+                print(f"[Agent] {self.host.name} flow failed: {result.get('error')}")
+                flows.q.put((fid, None, None))
+        # stdout closed: the agent exited, so flows still routed to it will never report back
+        with self._lock:
+            self._exited = True
+            lost, self._routes = self._routes, {}
+        if lost:
+            print(f"[Agent] {self.host.name} agent exited (rc={self.proc.poll()}); "
+                  f"{len(lost)} flows failed")
+        for flows, fid in lost.values():
+            flows.q.put((fid, None, None))
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.terminate()
+
+class AgentFlows:
+    """Completion source for flows run by a TrafficAgent; same wait()
+    interface as FlowReaper, but end (and the time a worker picked the
+    flow up, as start) come from the agent itself."""
+    def __init__(self, agent, dst_ip, port):
+        self.agent, self.dst_ip, self.port = agent, dst_ip, port
+        self.q = queue.SimpleQueue()
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def launch(self, fid, size):
+        self.pending += 1
+        self.agent.send(self, fid, self.dst_ip, self.port, size)
+
+    def wait(self, timeout=None):
+        try:
+            done = [self.q.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                done.append(self.q.get_nowait())
+            except queue.Empty:
+                break
+        self.pending -= len(done)
+        return done
+
+    def close(self):
+        pass
+
+def start_sink(host, port=SINK_PORT):
+    return host.popen([sys.executable, AGENT_SCRIPT, "sink", "--port", str(port)],
+                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 # -------------------------------
 # Traffic generator
 # -------------------------------
-def genDCTraffic(src, dst, traffic_type, intensity, duration, port=5001, on_done=None):
-    sampler = get_sampler(traffic_type)
-    recv = dst.popen(f"iperf -s -p {port} > /dev/null 2>&1", shell=True)
-    time.sleep(0.3)
-    in_flight, meta, seq, fcts = {}, {}, 0, []
-    t0, next_tick = time.time(), time.time()
+def genDCTraffic(src, dst, traffic_type, intensity, duration, port=5001, on_done=None,
+                 agent=None, arrivals=None, sizes=None):
+    """Generates flows from src to dst and reports each completed flow.
+    With `agent` (a TrafficAgent on src) flows go to the persistent sink
+    on dst at `port`; otherwise one iperf client is forked per flow.
+    `arrivals` (an ArrivalScheduler) decides when flows start; the default
+    launches `intensity` flows at every whole second. `sizes` is a
+    callable returning flow sizes (see get_sampler)."""
+    sampler = sizes or get_sampler(traffic_type)
+    if arrivals is None:
+        arrivals = ArrivalScheduler("burst", rate=intensity)
+    if agent is None:
+        recv = dst.popen(f"iperf -s -p {port} > /dev/null 2>&1", shell=True)
+        time.sleep(0.3)
+        flows = FlowReaper()
+    else:
+        recv = None
+        flows = AgentFlows(agent, dst.IP(), port)
+    meta, seq, fcts = {}, 0, []
+    arrivals.start(duration)
+    tags = arrivals.tags()
+    t0 = time.monotonic()
 
     try:
-        while (time.time() - t0) < duration or in_flight:
-            now = time.time()
-            # Launch new flows per second
-            if now >= next_tick and (now - t0) < duration:
-                for _ in range(intensity):
-                    seq += 1
-                    size_b = sampler()
-                    start = time.time()
+        while arrivals.next_due() is not None or len(flows):
+            # Launch every flow whose scheduled time has come
+            due = arrivals.next_due()
+            while due is not None and time.monotonic() - t0 >= due:
+                size_b, lag = arrivals.pop(time.monotonic() - t0)
+                seq += 1
+                size_b = size_b or sampler()
+                start = time.monotonic_ns()
+                meta[seq] = {"start": start, "size": size_b, "lag": lag}
+                if agent is None:
                     cmd = f"iperf -c {dst.IP()} -p {port} -n {size_b} > /dev/null 2>&1"
-                    proc = src.popen(cmd, shell=True)
-                    in_flight[seq] = proc
-                    meta[seq] = {"start": start, "size": size_b}
-                next_tick += 1
-            # Check completions
-            for fid, proc in list(in_flight.items()):
-                if proc.poll() is not None:
-                    end = time.time()
-                    fct = end - meta[fid]["start"]
-                    fcts.append(fct)
-                    record = {"src": src.name, "dst": dst.name,
-                              "traffic_type": traffic_type,
-                              "intensity": intensity,
-                              "size_bytes": meta[fid]["size"],
-                              "fct_s": fct}
-                    if on_done:
-                        on_done(record)
-                    del in_flight[fid], meta[fid]
-            time.sleep(0.01)
+                    flows.add(seq, src.popen(cmd, shell=True))
+                else:
+                    flows.launch(seq, size_b)
+                due = arrivals.next_due()
+            # Sleep until the next arrival or the next completion, whichever comes first;
+            # the last fraction of a millisecond before an arrival is spun instead
+            if due is None:
+                timeout = None
+            else:
+                remaining = due - (time.monotonic() - t0)
+                if remaining <= ArrivalScheduler.SPIN_S:
+                    if not len(flows):
+                        while time.monotonic() - t0 < due:
+                            pass
+                    timeout = 0
+                else:
+                    timeout = remaining - ArrivalScheduler.SPIN_S
+            for fid, start, end in flows.wait(timeout):
+                if end is None:
+                    del meta[fid]
+                    continue
+                # FCT runs from the launch, so time queued in the agent for a free
+                # worker counts; the queueing itself is reported as queue_s
+                picked, start = start, meta[fid]["start"]
+                fct = (end - start) / 1e9
+                fcts.append(fct)
+                record = {"src": src.name, "dst": dst.name,
+                          "traffic_type": traffic_type,
+                          "intensity": intensity,
+                          "size_bytes": meta[fid]["size"],
+                          "fct_s": fct,
+                          "start_ns": start, "end_ns": end,
+                          "launch_lag_s": meta[fid]["lag"], **tags}
+                if picked is not None:
+                    record["queue_s"] = (picked - start) / 1e9
+                if on_done:
+                    on_done(record)
+                del meta[fid]
     finally:
-        recv.terminate()
+        flows.close()
+        if recv is not None:
+            recv.terminate()
+    d = arrivals.drift()
+    if d["launched"]:
+        print(f"    [Sched] {arrivals.mode}: {d['launched']} flows, launch drift "
+              f"mean={d['mean_ms']:.2f} p50={d['p50_ms']:.2f} p99={d['p99_ms']:.2f} "
+              f"max={d['max_ms']:.2f} ms")
     return fcts
 
+# -------------------------------
+# Traffic matrices
+# -------------------------------
+MATRIX_MODES = ("pair", "permutation", "all-to-all", "incast", "hotspot")
+
+def traffic_matrix(mode, hosts, rng=random, incast_n=4, hotspot_frac=0.5):
+    """Returns the (src, dst) host pairs that are active together in one run.
+
+    - pair:        one random pair (the original single-flow-pair runs)
+    - permutation: every host sends to exactly one other host and receives
+                   from exactly one
+    - all-to-all:  every ordered pair of distinct hosts
+    - incast:      incast_n random senders to one receiver
+    - hotspot:     every host sends to one shared hot receiver with
+                   probability hotspot_frac, otherwise to a random other host
+    """
+    if mode == "pair":
+        return [tuple(rng.sample(hosts, 2))]
+    if mode == "permutation":
+        # Sattolo's algorithm: a random single cycle, so nobody sends to itself
+        order = list(hosts)
+        for i in range(len(order) - 1, 0, -1):
+            j = rng.randrange(i)
+            order[i], order[j] = order[j], order[i]
+        nxt = {a.name: b for a, b in zip(order, order[1:] + order[:1])}
+        return [(h, nxt[h.name]) for h in hosts]
+    if mode == "all-to-all":
+        return [(a, b) for a in hosts for b in hosts if a is not b]
+    if mode == "incast":
+        dst = rng.choice(hosts)
+        senders = [h for h in hosts if h is not dst]
+        return [(h, dst) for h in rng.sample(senders, min(incast_n, len(senders)))]
+    if mode == "hotspot":
+        hot = rng.choice(hosts)
+        pairs = []
+        for h in hosts:
+            if h is not hot and rng.random() < hotspot_frac:
+                pairs.append((h, hot))
+            else:
+                pairs.append((h, rng.choice([o for o in hosts if o is not h])))
+        return pairs
+    raise ValueError(f"traffic matrix must be one of {MATRIX_MODES}, got {mode!r}")
+
 # -------------------------------
 # Experiment runner
 # -------------------------------
+LOG_FORMATS = ("jsonl", "npz", "parquet")
+# Flow log path per format, as read by plot_result/fct_stats/telemetry (flows.npz names the batches)
+FLOW_LOGS = {"jsonl": "flows.jsonl", "npz": "flows.npz", "parquet": "flows.parquet"}
+
 class FlowLogger:
-    def __init__(self, path="flows.jsonl"):
-        self.path = path
-        if os.path.exists(path):
-            os.remove(path)
+    """Writes flow records from a background thread.
+
+    write() only enqueues (blocking if `max_queue` records are pending, so
+    nothing is dropped); the writer thread batches records and flushes
+    every `batch` records or `interval` seconds. close() drains the queue
+    and fsyncs, and also runs at interpreter exit.
+
+    - jsonl:   one JSON object per line in `path`
+    - npz:     one NumPy archive per batch, <path stem>.<chunk>.npz
+    - parquet: <path stem>.parquet (needs pyarrow; columns are fixed by
+               the first batch)
+    plot_result.load_flows reads all three back.
+    """
+    _FLUSH, _STOP = object(), object()
+
+    def __init__(self, path="flows.jsonl", append=False, fmt="jsonl",
+                 batch=1024, interval=1.0, max_queue=65536):
+        if fmt not in LOG_FORMATS:
+            raise ValueError(f"log format must be one of {LOG_FORMATS}, got {fmt!r}")
+        if fmt == "parquet" and pa is None:
+            raise RuntimeError("--log-format parquet needs pyarrow (pip install pyarrow)")
+        self.fmt, self.batch, self.interval = fmt, batch, interval
+        self.stem = os.path.splitext(path)[0]
+        self.path = {"jsonl": path, "npz": self.stem + ".*.npz",
+                     "parquet": self.stem + ".parquet"}[fmt]
+        self._chunk = 0
+        existing = sorted(glob.glob(self.path))
+        if append and fmt == "npz" and existing:
+            self._chunk = max(int(p.rsplit(".", 2)[1]) for p in existing) + 1
+        elif not append:
+            for p in existing:
+                os.remove(p)
+        if fmt == "parquet" and append and existing:
+            raise RuntimeError("Parquet files cannot be appended to; use jsonl or npz")
+        self._file = open(path, "a") if fmt == "jsonl" else None
+        self._parquet = None
+        self.error = None
+        self.q = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
     def write(self, record):
-        with open(self.path, "a") as f:
-            f.write(json.dumps(record) + "\n")
+        if self.error is not None:
+            raise RuntimeError("flow log writer failed") from self.error
+        self.q.put(record)
+
+    def sync(self):
+        """Blocks until every record written so far is on disk."""
+        if self._thread.is_alive():
+            self.q.put(self._FLUSH)
+            self.q.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self.q.put(self._STOP)
+            self._thread.join()
+
+    def _run(self):
+        pending, deadline = [], None
+        while True:
+            timeout = None if not pending else max(deadline - time.monotonic(), 0)
+            try:
+                item = self.q.get(timeout=timeout)
+            except queue.Empty:
+                item = None         # batch timer expired
+            if item is None or item is self._FLUSH or item is self._STOP:
+                self._flush(pending, durable=item is self._STOP)
+                pending = []
+                if item is not None:
+                    self.q.task_done()
+                if item is self._STOP:
+                    return
+                continue
+            self.q.task_done()
+            if not pending:
+                deadline = time.monotonic() + self.interval
+            pending.append(item)
+            if len(pending) >= self.batch:
+                self._flush(pending)
+                pending = []
+
+    def _flush(self, records, durable=False):
+        try:
+            if records:
+                getattr(self, "_write_" + self.fmt)(records)
+            if durable:
+                if self._file is not None:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    self._file.close()
+                if self._parquet is not None:
+                    self._parquet.close()
+        except Exception as e:      # surfaced to producers by write()
+            self.error = e
+            print(f"[Log] writing {self.path} failed: {e}")
+
+    def _write_jsonl(self, records):
+        self._file.write("".join(json.dumps(r) + "\n" for r in records))
+        self._file.flush()
+
+    def _write_npz(self, records):
+        keys = list(dict.fromkeys(k for r in records for k in r))
+        cols = {}
+        for k in keys:
+            vals = [r.get(k) for r in records]
+            if all(isinstance(v, str) or v is None for v in vals):
+                cols[k] = np.array(["" if v is None else v for v in vals])
+            else:
+                cols[k] = np.array([np.nan if v is None else v for v in vals])
+        path = f"{self.stem}.{self._chunk:05d}.npz"
+        self._chunk += 1
+        with open(path, "wb") as f:
+            np.savez(f, **cols)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_parquet(self, records):
+        if self._parquet is None:
+            table = pa.Table.from_pylist(records)
+            self._parquet = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.Table.from_pylist(records, schema=self._parquet.schema)
+        self._parquet.write_table(table)
 
 class Experiment:
-    def __init__(self, net):
+    def __init__(self, net, generator="iperf", workers=64, arrival="burst",
+                 loads=None, trace=None, link_bps=20e6, matrix="pair", incast_n=4,
+                 hotspot_frac=0.5, prefix="", append=False, log_format="jsonl",
+                 dists=None):
         self.net = net
-        self.logger = FlowLogger()
+        self.logger = FlowLogger(append=append, fmt=log_format)
+        self.generator = generator
+        self.workers = workers
+        self.arrival = arrival      # ArrivalScheduler mode
+        self.loads = loads          # offered loads (fraction of link_bps) replacing the intensity sweep
+        self.trace = trace
+        self.link_bps = link_bps
+        self.matrix = matrix        # traffic_matrix mode, all its pairs run concurrently
+        self.incast_n = incast_n
+        self.hotspot_frac = hotspot_frac
+        self.prefix = prefix        # topology name prefix, stripped from logged host names
+        # traffic type -> FlowSizeDist
+        self.dists = dists or {t: FlowSizeDist.builtin(name) for t, name in TYPE_DISTS.items()}
+        self.agents, self.sinks = {}, {}
+        self.stats = FCTStats()
+        self._log_lock = threading.Lock()
+    def _agent(self, src, dst):
+        """Returns src's traffic agent, starting it and dst's sink on first use."""
+        if dst.name not in self.sinks:
+            self.sinks[dst.name] = start_sink(dst)
+            time.sleep(0.3)
+        if src.name not in self.agents:
+            self.agents[src.name] = TrafficAgent(src, self.workers)
+        return self.agents[src.name]
+    def close(self):
+        self.logger.close()
+        for agent in self.agents.values():
+            agent.close()
+        for sink in self.sinks.values():
+            sink.terminate()
     def _on_done(self, rec):
-        print(f"[Flow] {rec}")
-        self.logger.write(rec)
+        rec["matrix"] = self.matrix
+        if self.prefix:
+            rec["src"], rec["dst"] = rec["src"][len(self.prefix):], rec["dst"][len(self.prefix):]
+        with self._log_lock:
+            print(f"[Flow] {rec}")
+            self.logger.write(rec)
+            self.stats.add(rec)
     def run(self, times=10, intensity=10, duration=10):
-        hosts = [self.net.get(f"h{i}") for i in range(1, 5)]
+        hosts = self.net.hosts
         for rep in range(times):
-            src, dst = random.sample(hosts, 2)
-            print(f"\n[Run {rep+1}/{times}] {src.name} → {dst.name}")
+            pairs = traffic_matrix(self.matrix, hosts, incast_n=self.incast_n,
+                                   hotspot_frac=self.hotspot_frac)
+            if len(pairs) == 1:
+                print(f"\n[Run {rep+1}/{times}] {pairs[0][0].name} → {pairs[0][1].name}")
+            else:
+                print(f"\n[Run {rep+1}/{times}] {self.matrix}: {len(pairs)} concurrent pairs")
             for t in (1, 2):
                 label = "WebSearch" if t==1 else "DataMining"
                 print(f"  Type={label}")
-                for bulk in range(1, intensity+1):
-                    print(f"    Intensity {bulk}/{intensity}")
-                    genDCTraffic(src, dst, t, bulk, duration, on_done=self._on_done)
+                steps = self.loads or range(1, intensity+1)
+                for i, step in enumerate(steps, 1):
+                    scheds = [self._scheduler(t, step) for _ in pairs]
+                    bulk = step if self.loads is None else round(scheds[0].rate, 2)
+                    print(f"    Intensity {i}/{len(steps)}: {bulk} flows/s per pair ({scheds[0].mode})")
+                    self._run_pairs(pairs, t, bulk, duration, scheds)
+                    print(f"    [Stats] {self.stats.summary(t, bulk)}")
+    def _run_pairs(self, pairs, traffic_type, bulk, duration, scheds):
+        """Runs genDCTraffic for every pair at once, one thread per pair."""
+        jobs = []
+        for idx, ((src, dst), sched) in enumerate(zip(pairs, scheds)):
+            if self.generator == "agent":
+                # Agents are shared between pairs, so start them before any thread runs
+                kw = {"port": SINK_PORT, "agent": self._agent(src, dst)}
+            else:
+                # iperf servers are per pair; pairs sharing a destination need their own port
+                kw = {"port": 5001 + idx}
+            sizes = self.dists[traffic_type].sampler(random.getrandbits(64))
+            jobs.append(((src, dst, traffic_type, bulk, duration),
+                         dict(kw, on_done=self._on_done, arrivals=sched, sizes=sizes)))
+        if len(jobs) == 1:
+            genDCTraffic(*jobs[0][0], **jobs[0][1])
+            return
+        # result() re-raises a pair's failure here, after every pair has finished,
+        # so a broken run ends with an error instead of silently missing pairs
+        with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            futures = [pool.submit(genDCTraffic, *a, **kw) for a, kw in jobs]
+        for fut in futures:
+            fut.result()
+    def _scheduler(self, traffic_type, step):
+        # Seeded from the global generator so --seed also fixes arrival times and sizes
+        seed = random.getrandbits(32)
+        if self.loads is None:
+            return ArrivalScheduler(self.arrival, rate=step, trace=self.trace, seed=seed)
+        return ArrivalScheduler(self.arrival, load=step, mean_size=self.dists[traffic_type].mean(),
+                                link_bps=self.link_bps, trace=self.trace, seed=seed)
 
 # -------------------------------
 # Stats and plotting
 # -------------------------------
-def compute_stats(df):
-    rows = []
-    for (t, i), g in df.groupby(["traffic_type", "intensity"]):
-        fcts = g["fct_s"].values
-        rows.append({
-            "traffic_type": "WebSearch" if t==1 else "DataMining",
-            "intensity": i,
-            "mean_fct": np.mean(fcts),
-            "p95_fct": np.percentile(fcts, 95),
-            "p99_fct": np.percentile(fcts, 99)
-        })
-    return pd.DataFrame(rows)
-
-def plot_cdf(df):
+def plot_cdf(stats):
+    groups = stats.by_intensity()
     for t, name in [(1, "WebSearch"), (2, "DataMining")]:
-        subset = df[df["traffic_type"]==t]
         plt.figure(figsize=(8,5))
-        for inten, group in subset.groupby("intensity"):
-            vals = np.sort(group["fct_s"].values)
-            y = np.arange(1, len(vals)+1)/len(vals)
-            plt.plot(vals, y, label=f"{inten} flows/s")
+        for (_, inten), hist in sorted((k, h) for k, h in groups.items() if k[0]==t):
+            vals, y = hist.cdf()
+            plt.step(vals, y, where="post", label=f"{inten} flows/s")
         plt.xlabel("Flow Completion Time (s)")
         plt.ylabel("CDF")
         plt.title(f"CDF of FCT – {name}")
@@ -170,29 +749,126 @@ def plot_cdf(df):
 # -------------------------------
 # Main
 # -------------------------------
+def make_topo(name, k, prefix=""):
+    if name == "onepod":
+        return OnePodFatTree(prefix=prefix)
+    return FatTree(k=k, prefix=prefix)
+
+def wait_for_discovery(topo, wsapi_port, timeout):
+    """Blocks until the controller (lb_topology = discover) reports every
+    switch-to-switch link of topo in its lb_topology_links gauge; until then
+    it drops traffic on switches whose links are still unknown."""
+    expected = 2 * sum(1 for a, b in topo.links() if topo.isSwitch(a) and topo.isSwitch(b))
+    url = f"http://127.0.0.1:{wsapi_port}/metrics"
+    deadline = time.monotonic() + timeout
+    found = None
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as resp:
+                for line in resp.read().decode().splitlines():
+                    if line.startswith("lb_topology_links "):
+                        found = int(float(line.split()[1]))
+        except OSError:
+            pass
+        if found is not None and found >= expected:
+            print(f"[NET] Controller discovered all {expected // 2} switch links.")
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"topology discovery incomplete after {timeout:g}s: {found} of {expected} "
+                       f"directed switch links at {url} (is the controller running with "
+                       f"lb_topology = discover and --observe-links?)")
+
 def main():
+    ap = argparse.ArgumentParser(description="Lab 2 FCT experiment")
+    ap.add_argument("--topo", choices=["onepod", "fattree"], default="onepod")
+    ap.add_argument("--k", type=int, default=4, help="fat-tree arity (--topo fattree)")
+    ap.add_argument("--generator", choices=["iperf", "agent"], default="iperf",
+                    help="iperf: fork one iperf per flow; agent: persistent traffic_agent.py")
+    ap.add_argument("--arrival", choices=ARRIVAL_MODES, default="burst",
+                    help="flow arrival process (burst = N flows at each second)")
+    ap.add_argument("--load", type=float, nargs="+",
+                    help="offered loads as fractions of link capacity, replacing the 1..10 flows/s sweep")
+    ap.add_argument("--trace", help="JSONL arrival trace for --arrival trace")
+    ap.add_argument("--link-mbps", type=float, default=20, help="link capacity for --load")
+    ap.add_argument("--matrix", choices=MATRIX_MODES, default="pair",
+                    help="host pairs driven concurrently in each run")
+    ap.add_argument("--incast-n", type=int, default=4, help="senders per receiver for --matrix incast")
+    ap.add_argument("--hotspot-frac", type=float, default=0.5,
+                    help="share of hosts sending to the hot receiver for --matrix hotspot")
+    ap.add_argument("--times", type=int, default=10, help="repetitions (new host pairs each time)")
+    ap.add_argument("--intensity", type=int, default=10, help="sweep 1..N flows/s per pair")
+    ap.add_argument("--duration", type=float, default=10, help="seconds per intensity step")
+    ap.add_argument("--seed", type=int, help="seed host pairs, flow sizes and arrivals")
+    ap.add_argument("--controller-port", type=int, default=6633)
+    ap.add_argument("--controller-wsapi-port", type=int, default=8080,
+                    help="controller metrics port, polled for topology discovery (--topo fattree)")
+    ap.add_argument("--discovery-timeout", type=float, default=60,
+                    help="seconds to wait for LLDP discovery before a fat-tree run (0 = don't wait)")
+    ap.add_argument("--prefix", default="", help="node name prefix, for several networks on one machine")
+    ap.add_argument("--append", action="store_true", help="append to flows.jsonl instead of replacing it")
+    ap.add_argument("--size-interp", choices=INTERP_MODES, default="step",
+                    help="flow sizes between CDF breakpoints: step keeps the exact breakpoints")
+    ap.add_argument("--websearch-cdf", default="websearch", help="CDF file replacing the WebSearch sizes")
+    ap.add_argument("--datamining-cdf", default="datamining", help="CDF file replacing the DataMining sizes")
+    ap.add_argument("--size-unit", type=float, default=1.0, help="bytes per size unit in the CDF files")
+    ap.add_argument("--telemetry", action="store_true",
+                    help="sample port counters, queues and flow tables; writes flows_telemetry.jsonl")
+    ap.add_argument("--telemetry-interval", type=float, default=0.1, help="seconds between counter samples")
+    ap.add_argument("--log-format", choices=LOG_FORMATS, default="jsonl",
+                    help="flow record format (npz/parquet are written as flows.*.npz / flows.parquet)")
+    args = ap.parse_args()
+    if args.arrival == "trace" and not args.trace:
+        ap.error("--arrival trace needs --trace")
+    if args.trace and not os.path.isfile(args.trace):
+        ap.error(f"--trace {args.trace}: no such file")
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    # sweep.py stops cells with SIGTERM; turn it into SystemExit so the finally below still runs net.stop()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
     setLogLevel("info")
-    topo = OnePodFatTree()
-    net = Mininet(topo=topo, link=TCLink, switch=OVSSwitch,
-                  controller=None, autoSetMacs=True)
-    net.addController("c0", controller=RemoteController,
-                      ip="127.0.0.1", port=6633)
-    net.start()
-    net.staticArp()
-    print("[NET] Static ARP tables configured.")
+    # Load the size distributions first: Mininet() already creates namespaces and links,
+    # so a bad CDF file must fail before anything exists that net.stop() would clean up
+    dists = {1: load_dist(args.websearch_cdf, args.size_interp, args.size_unit),
+             2: load_dist(args.datamining_cdf, args.size_interp, args.size_unit)}
+    topo = make_topo(args.topo, args.k, args.prefix)
 
+    net = sampler = exp = None
     try:
-        exp = Experiment(net)
-        exp.run(times=10, intensity=10, duration=10)
-
-        df = pd.DataFrame([json.loads(l) for l in open("flows.jsonl")])
-        stats = compute_stats(df)
-        stats.to_csv("stats.csv", index=False)
-        plot_cdf(df)
-        print("[RESULT] stats.csv and CDF plots generated.")
+        net = Mininet(topo=topo, link=TCLink, switch=OVSSwitch,
+                      controller=None, autoSetMacs=True)
+        net.addController("c0", controller=RemoteController,
+                          ip="127.0.0.1", port=args.controller_port)
+        net.start()
+        net.staticArp()
+        print("[NET] Static ARP tables configured.")
+        if args.topo == "fattree" and args.discovery_timeout > 0:
+            wait_for_discovery(topo, args.controller_wsapi_port, args.discovery_timeout)
+
+        if args.telemetry:
+            sampler = telemetry.TelemetrySampler(net, interval=args.telemetry_interval,
+                                                 link_bps=args.link_mbps * 1e6, prefix=args.prefix).start()
+        exp = Experiment(net, generator=args.generator, arrival=args.arrival,
+                         loads=args.load, trace=args.trace, link_bps=args.link_mbps * 1e6,
+                         matrix=args.matrix, incast_n=args.incast_n, hotspot_frac=args.hotspot_frac,
+                         prefix=args.prefix, append=args.append, log_format=args.log_format,
+                         dists=dists)
+        exp.run(times=args.times, intensity=args.intensity, duration=args.duration)
+
+        exp.stats.write_csv("stats.csv", "stats_by_size.csv")
+        exp.stats.save("stats.npz")
+        plot_cdf(exp.stats)
+        print("[RESULT] stats.csv, stats_by_size.csv and CDF plots generated.")
     finally:
-        net.stop()
-        print("[NET] Stopped.")
+        if exp is not None:
+            exp.close()
+        if sampler is not None:
+            sampler.stop()
+            if exp is not None:
+                telemetry.join(FLOW_LOGS[args.log_format])
+        if net is not None:
+            net.stop()
+            print("[NET] Stopped.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Streaming FCT statistics (Lab 2)
+--------------------------------
+Constant-memory flow completion time summaries.
+
+Each (traffic_type, intensity, size bucket) group keeps a log-bucketed
+histogram (HDR/DDSketch style: every bucket spans a fixed ratio, so any
+quantile is accurate to REL_ERR relative error) plus the exact count, sum,
+min and max. Histograms are plain count arrays, so groups and whole runs
+merge by addition. Confidence intervals come from a multinomial bootstrap
+over the bucket counts, computed for all resamples at once.
+
+experiment.py feeds an FCTStats from its on_done callback and writes
+stats.csv (per type and intensity), stats_by_size.csv and the mergeable
+state stats.npz at the end of a run.
+
+    python3 fct_stats.py build flows.jsonl                 # stats from an old run
+    python3 fct_stats.py build flows.npz                   # --log-format npz batches (or flows.parquet)
+    python3 fct_stats.py merge a/stats.npz b/stats.npz -o merged
+"""
+
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+REL_ERR = 0.01                  # quantile accuracy
+MIN_FCT, MAX_FCT = 1e-6, 1e4    # seconds; values outside are clamped into the end buckets
+SIZE_BUCKETS = [100_000, 1_000_000, 10_000_000]     # bytes, upper bounds
+TYPE_NAMES = {1: "WebSearch", 2: "DataMining"}
+
+_GAMMA = (1 + REL_ERR) / (1 - REL_ERR)
+_LOG_GAMMA = math.log(_GAMMA)
+_NBUCKETS = int(math.ceil(math.log(MAX_FCT / MIN_FCT) / _LOG_GAMMA)) + 1
+# Bucket i covers (MIN_FCT * gamma^(i-1), MIN_FCT * gamma^i]; its representative
+# value is within REL_ERR of everything in it
+_VALUES = MIN_FCT * _GAMMA ** np.arange(_NBUCKETS) * 2 / (_GAMMA + 1)
+
+def size_bucket(size):
+    for i, bound in enumerate(SIZE_BUCKETS):
+        if size <= bound:
+            return i
+    return len(SIZE_BUCKETS)
+
+def size_label(bucket):
+    fmt = lambda b: f"{b / 1e6:g}MB" if b >= 1e6 else f"{b / 1e3:g}KB"
+    if bucket == 0:
+        return f"<={fmt(SIZE_BUCKETS[0])}"
+    if bucket == len(SIZE_BUCKETS):
+        return f">{fmt(SIZE_BUCKETS[-1])}"
+    return f"{fmt(SIZE_BUCKETS[bucket - 1])}-{fmt(SIZE_BUCKETS[bucket])}"
+
+# -------------------------------
+# Histogram
+# -------------------------------
+class LogHistogram:
+    def __init__(self):
+        self.counts = np.zeros(_NBUCKETS, dtype=np.int64)
+        self.n, self.total = 0, 0.0
+        self.min, self.max = math.inf, -math.inf
+
+    def add(self, value):
+        v = min(max(value, MIN_FCT), MAX_FCT)
+        self.counts[max(0, int(math.ceil(math.log(v / MIN_FCT) / _LOG_GAMMA)))] += 1
+        self.n += 1
+        self.total += value
+        self.min, self.max = min(self.min, value), max(self.max, value)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.n += other.n
+        self.total += other.total
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.n if self.n else math.nan
+
+    def quantile(self, q):
+        if not self.n:
+            return math.nan
+        idx = np.searchsorted(np.cumsum(self.counts), q * self.n, side="left")
+        return float(min(max(_VALUES[min(idx, _NBUCKETS - 1)], self.min), self.max))
+
+    def cdf(self):
+        """(values, cumulative fraction) over the non-empty buckets."""
+        nz = np.nonzero(self.counts)[0]
+        return _VALUES[nz], np.cumsum(self.counts[nz]) / max(self.n, 1)
+
+    def bootstrap(self, qs, resamples=1000, alpha=0.05, rng=None):
+        """Percentile-bootstrap CIs for the mean and each quantile in qs.
+
+        Each resample redistributes n flows over the buckets with a
+        multinomial draw; all resamples are evaluated as one matrix.
+        Returns {"mean": (lo, hi), q: (lo, hi), ...}.
+        """
+        if self.n < 2:
+            return {k: (math.nan, math.nan) for k in ["mean", *qs]}
+        rng = rng or np.random.default_rng(0)
+        nz = np.nonzero(self.counts)[0]
+        draws = rng.multinomial(self.n, self.counts[nz] / self.n, size=resamples)
+        values = _VALUES[nz]
+        out = {"mean": draws @ values / self.n}
+        cum = np.cumsum(draws, axis=1)
+        for q in qs:
+            # First bucket whose cumulative count reaches q*n, per resample
+            out[q] = values[np.argmax(cum >= q * self.n, axis=1)]
+        lo, hi = 100 * alpha / 2, 100 * (1 - alpha / 2)
+        return {k: (float(np.percentile(v, lo)), float(np.percentile(v, hi)))
+                for k, v in out.items()}
+
+# -------------------------------
+# Grouped statistics
+# -------------------------------
+class FCTStats:
+    """Histograms keyed by (traffic_type, intensity, size bucket)."""
+    def __init__(self):
+        self.groups = {}
+
+    def add(self, record):
+        key = (record["traffic_type"], record["intensity"], size_bucket(record["size_bytes"]))
+        hist = self.groups.get(key)
+        if hist is None:
+            hist = self.groups[key] = LogHistogram()
+        hist.add(record["fct_s"])
+
+    def merge(self, other):
+        for key, hist in other.groups.items():
+            if key in self.groups:
+                self.groups[key].merge(hist)
+            else:
+                self.groups[key] = LogHistogram().merge(hist)
+        return self
+
+    def by_intensity(self):
+        """Histograms merged over size buckets: (type, intensity) -> LogHistogram."""
+        merged = {}
+        for (t, i, _), hist in self.groups.items():
+            merged.setdefault((t, i), LogHistogram()).merge(hist)
+        return merged
+
+    def summary(self, traffic_type, intensity):
+        """Live one-line summary of one (type, intensity) group."""
+        hist = self.by_intensity().get((traffic_type, intensity))
+        if hist is None:
+            return "no flows"
+        return (f"n={hist.n} mean={hist.mean():.3f}s p50={hist.quantile(0.5):.3f}s "
+                f"p95={hist.quantile(0.95):.3f}s p99={hist.quantile(0.99):.3f}s")
+
+    @staticmethod
+    def _row(hist, resamples):
+        ci = hist.bootstrap([0.5, 0.95, 0.99], resamples)
+        row = {"mean_fct": hist.mean(), "p95_fct": hist.quantile(0.95),
+               "p99_fct": hist.quantile(0.99), "p50_fct": hist.quantile(0.5), "count": hist.n}
+        for key, name in (("mean", "mean"), (0.5, "p50"), (0.95, "p95"), (0.99, "p99")):
+            row[f"{name}_ci_lo"], row[f"{name}_ci_hi"] = ci[key]
+        return row
+
+    def rows(self, resamples=1000):
+        """stats.csv rows; the first five columns match the original compute_stats."""
+        return [dict(traffic_type=TYPE_NAMES.get(t, t), intensity=i, **self._row(hist, resamples))
+                for (t, i), hist in sorted(self.by_intensity().items())]
+
+    def size_rows(self, resamples=1000):
+        return [dict(traffic_type=TYPE_NAMES.get(t, t), intensity=i, size_bucket=size_label(b),
+                     **self._row(hist, resamples))
+                for (t, i, b), hist in sorted(self.groups.items())]
+
+    def write_csv(self, path="stats.csv", by_size_path="stats_by_size.csv", resamples=1000):
+        for rows, p in ((self.rows(resamples), path), (self.size_rows(resamples), by_size_path)):
+            if not p:
+                continue
+            with open(p, "w") as f:
+                if rows:
+                    f.write(",".join(rows[0]) + "\n")
+                    for row in rows:
+                        f.write(",".join(_fmt(v) for v in row.values()) + "\n")
+
+    def save(self, path="stats.npz"):
+        keys = sorted(self.groups)
+        np.savez_compressed(
+            path,
+            keys=np.array([[t, i, b] for t, i, b in keys], dtype=float).reshape(-1, 3),
+            counts=np.array([self.groups[k].counts for k in keys]).reshape(-1, _NBUCKETS),
+            moments=np.array([[self.groups[k].n, self.groups[k].total,
+                               self.groups[k].min, self.groups[k].max] for k in keys]).reshape(-1, 4),
+            rel_err=REL_ERR)
+
+    @classmethod
+    def load(cls, path):
+        stats = cls()
+        with np.load(path) as z:
+            if float(z["rel_err"]) != REL_ERR:
+                raise ValueError(f"{path}: saved with rel_err={float(z['rel_err'])}, expected {REL_ERR}")
+            for (t, i, b), counts, (n, total, lo, hi) in zip(z["keys"], z["counts"], z["moments"]):
+                hist = LogHistogram()
+                hist.counts[:] = counts
+                hist.n, hist.total, hist.min, hist.max = int(n), float(total), float(lo), float(hi)
+                stats.groups[(int(t), i if i % 1 else int(i), int(b))] = hist
+        return stats
+
+def _fmt(v):
+    return f"{v:.6g}" if isinstance(v, float) else str(v)
+
+# -------------------------------
+# Main
+# -------------------------------
+def read_records(path):
+    """Yields the records of a flow log: flows.jsonl, flows.parquet or flows.npz
+    (the --log-format npz batches); the columnar ones are read with pandas."""
+    if path.endswith((".parquet", ".npz")):
+        from plot_result import flow_records
+        yield from flow_records(path)
+        return
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def cmd_build(args):
+    stats = FCTStats()
+    for path in args.flows:
+        for record in read_records(path):
+            stats.add(record)
+    return stats
+
+def cmd_merge(args):
+    stats = FCTStats()
+    for path in args.states:
+        stats.merge(FCTStats.load(path))
+    return stats
+
+def main():
+    ap = argparse.ArgumentParser(description="Streaming FCT statistics")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    build = sub.add_parser("build", help="stream flow logs (jsonl, parquet or npz batches) into statistics")
+    build.add_argument("flows", nargs="+")
+    build.set_defaults(func=cmd_build)
+    merge = sub.add_parser("merge", help="merge saved stats.npz states")
+    merge.add_argument("states", nargs="+")
+    merge.set_defaults(func=cmd_merge)
+    for p in (build, merge):
+        p.add_argument("-o", "--out", default=".", help="output directory")
+        p.add_argument("--resamples", type=int, default=1000, help="bootstrap resamples")
+    args = ap.parse_args()
+
+    stats = args.func(args)
+    os.makedirs(args.out, exist_ok=True)
+    stats.write_csv(os.path.join(args.out, "stats.csv"),
+                    os.path.join(args.out, "stats_by_size.csv"), args.resamples)
+    stats.save(os.path.join(args.out, "stats.npz"))
+    for (t, i), hist in sorted(stats.by_intensity().items()):
+        print(f"[Stats] {TYPE_NAMES.get(t, t)} @ {i}: {stats.summary(t, i)}")
+
+if __name__ == "__main__":
+    main()
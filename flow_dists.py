@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Flow size distributions (Lab 2)
+-------------------------------
+Empirical flow-size CDFs sampled in NumPy batches.
+
+A FlowSizeDist is a list of (size, cdf) breakpoints plus an interpolation
+mode:
+- step:   sizes are exactly the breakpoints (the original ECDF sampling)
+- linear: sizes are spread uniformly between consecutive breakpoints
+- log:    sizes are spread log-uniformly between consecutive breakpoints
+Probability mass below the first breakpoint's CDF value is a point mass at
+the first size.
+
+Sizes are drawn with np.searchsorted on uniform batches from a seeded
+np.random.Generator, so a run can be reproduced from its seed. CDF files
+hold one breakpoint per line, with the size in the first column and the
+CDF in the last (e.g. "35000 0.6", or the three-column "size 1 cdf" files
+published with pFabric/DCTCP). The CDF can be in [0, 1] or in percent.
+
+    python3 flow_dists.py websearch --interp log -n 100000
+    python3 flow_dists.py DCTCP_CDF.txt --unit 1460
+"""
+
+import argparse
+import math
+
+import numpy as np
+
+INTERP_MODES = ("step", "linear", "log")
+
+# -------------------------------
+# Built-in distributions
+# -------------------------------
+WEBSEARCH_ECDF = [(10_000,0.10),(20_000,0.30),(35_000,0.60),
+                  (50_000,0.90),(80_000,0.95),(100_000,1.0)]
+DATAMINING_ECDF = [
+    (50_000,      0.10),  # 50 KB    → 10% of flows are ≤ 50 KB
+    (100_000,     0.20),  # 100 KB   → 20% of flows are ≤ 100 KB
+    (250_000,     0.30),  # 250 KB   → 30% of flows are ≤ 250 KB
+    (500_000,     0.40),  # 500 KB   → 40% of flows are ≤ 500 KB
+    (1_000_000,   0.60),  # 1 MB     → 60% of flows are ≤ 1 MB
+    (2_000_000,   0.70),  # 2 MB     → 70% of flows are ≤ 2 MB
+    (5_000_000,   0.80),  # 5 MB     → 80% of flows are ≤ 5 MB
+    (10_000_000,  1.00),  # 10 MB    → 100% of flows are ≤ 10 MB (max)
+]
+BUILTIN = {"websearch": WEBSEARCH_ECDF, "datamining": DATAMINING_ECDF}
+
+# -------------------------------
+# Distribution
+# -------------------------------
+class FlowSizeDist:
+    def __init__(self, points, interp="step", name=None):
+        if interp not in INTERP_MODES:
+            raise ValueError(f"interpolation must be one of {INTERP_MODES}, got {interp!r}")
+        if not points:
+            raise ValueError("a flow size distribution needs at least one breakpoint")
+        sizes = np.array([float(s) for s, _ in points])
+        cdf = np.array([float(p) for _, p in points])
+        if np.any(np.diff(sizes) < 0) or np.any(np.diff(cdf) < 0):
+            raise ValueError(f"{name or 'distribution'}: sizes and CDF must be non-decreasing")
+        if interp == "log" and sizes[0] <= 0:
+            raise ValueError(f"{name or 'distribution'}: log interpolation needs positive sizes")
+        cdf[-1] = 1.0               # absorb rounding in published files
+        self.sizes, self.cdf, self.interp = sizes, cdf, interp
+        self.name = name or "custom"
+        # Segment i runs from (lo[i], cdf[i-1]) to (sizes[i], cdf[i]); the first
+        # segment starts at the first size, i.e. a point mass up to cdf[0]
+        self._lo = np.concatenate(([sizes[0]], sizes[:-1]))
+        self._plo = np.concatenate(([0.0], cdf[:-1]))
+
+    @classmethod
+    def builtin(cls, name, interp="step"):
+        return cls(BUILTIN[name], interp, name)
+
+    @classmethod
+    def from_file(cls, path, interp="step", unit=1.0):
+        """Loads a CDF file: size in the first column, CDF in the last.
+        Comment (#) and header lines are skipped, and CDFs above 1 are
+        taken as percentages."""
+        points = []
+        with open(path) as f:
+            for line in f:
+                fields = line.split("#", 1)[0].replace(",", " ").split()
+                if len(fields) < 2:
+                    continue
+                try:
+                    points.append((float(fields[0]) * unit, float(fields[-1])))
+                except ValueError:
+                    continue        # header line
+        if points and max(p for _, p in points) > 1.0 + 1e-9:
+            points = [(s, p / 100.0) for s, p in points]
+        return cls(points, interp, name=path)
+
+    def quantile(self, u):
+        """Maps uniform draws u in [0, 1) to flow sizes (vectorized)."""
+        u = np.asarray(u, dtype=float)
+        idx = np.minimum(np.searchsorted(self.cdf, u, side="left"), len(self.cdf) - 1)
+        if self.interp == "step":
+            return self.sizes[idx]
+        lo, hi = self._lo[idx], self.sizes[idx]
+        plo, phi = self._plo[idx], self.cdf[idx]
+        width = phi - plo
+        frac = np.divide(u - plo, width, out=np.ones_like(u), where=width > 0)
+        frac = np.clip(frac, 0.0, 1.0)
+        if self.interp == "linear":
+            return lo + frac * (hi - lo)
+        return np.exp(np.log(lo) + frac * (np.log(hi) - np.log(lo)))
+
+    def sample(self, n, rng):
+        """Draws n sizes in bytes as int64."""
+        return np.maximum(np.rint(self.quantile(rng.random(n))), 1).astype(np.int64)
+
+    def mean(self):
+        """Mean flow size in bytes under the chosen interpolation."""
+        dp = self.cdf - self._plo
+        lo, hi = self._lo, self.sizes
+        if self.interp == "step":
+            seg = hi
+        elif self.interp == "linear":
+            seg = (lo + hi) / 2
+        else:
+            seg = np.array([a if math.isclose(a, b) else (b - a) / math.log(b / a)
+                            for a, b in zip(lo, hi)])
+        return float(np.sum(seg * dp))
+
+    def sampler(self, seed=None, batch=4096):
+        return BatchSampler(self, np.random.default_rng(seed), batch)
+
+class BatchSampler:
+    """Callable returning one size per call from pre-drawn batches."""
+    def __init__(self, dist, rng, batch=4096):
+        self.dist, self.rng, self.batch = dist, rng, batch
+        self._buf = []
+
+    def __call__(self):
+        if not self._buf:
+            # Reversed so pop() hands out the batch in draw order
+            self._buf = self.dist.sample(self.batch, self.rng).tolist()[::-1]
+        return self._buf.pop()
+
+def load_dist(spec, interp="step", unit=1.0):
+    """Built-in name (websearch, datamining) or CDF file path."""
+    if spec in BUILTIN:
+        return FlowSizeDist.builtin(spec, interp)
+    return FlowSizeDist.from_file(spec, interp, unit)
+
+# -------------------------------
+# Main
+# -------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Inspect a flow size distribution")
+    ap.add_argument("dist", help="websearch, datamining or a CDF file")
+    ap.add_argument("--interp", choices=INTERP_MODES, default="step")
+    ap.add_argument("--unit", type=float, default=1.0, help="bytes per size unit in the file")
+    ap.add_argument("-n", type=int, default=100_000, help="samples to draw")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    dist = load_dist(args.dist, args.interp, args.unit)
+    sizes = dist.sample(args.n, np.random.default_rng(args.seed))
+    print(f"[Dist] {dist.name} ({dist.interp}): {len(dist.sizes)} breakpoints, "
+          f"mean {dist.mean():,.0f} B (sampled {sizes.mean():,.0f} B)")
+    print("[Dist] " + "  ".join(f"p{q}={np.percentile(sizes, q):,.0f}" for q in (10, 50, 90, 99)))
+    print(f"[Dist] {len(np.unique(sizes))} distinct sizes in {args.n} samples")
+
+if __name__ == "__main__":
+    main()
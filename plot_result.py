@@ -7,26 +7,199 @@ Plot script for Lab 2 results
   2. Mean FCT vs Intensity
   3. 95th/99th percentile FCT vs Intensity
   4. Boxplot of FCT distribution (with outliers)
+- flows.jsonl is parsed once into compact typed columns and cached next to
+  it (flows.jsonl.cache/, one .npy per column, memory-mapped on reload);
+  flows.parquet and the flows.<chunk>.npz batches of --log-format are read
+  the same way
+- report: renders the plots of every attempt found under a directory in a
+  process pool (headless Agg backend), plus cross-attempt and per-policy
+  p99/mean comparisons, skipping figures newer than their inputs
 """
 
+import argparse
+import glob
 import json
+import math
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from pandas.api.types import union_categoricals
 
 # -------------------------------
 # Load data
 # -------------------------------
-def load_flows(path="flows.jsonl"):
-    records = []
-    with open(path, "r") as f:
-        for line in f:
-            records.append(json.loads(line))
-    return pd.DataFrame(records)
+# Compact dtypes for known flow record fields; other fields keep pandas' choice
+FLOW_DTYPES = {
+    "src": "category", "dst": "category", "matrix": "category", "arrival": "category",
+    "traffic_type": "int8", "size_bytes": "int32", "fct_s": "float32",
+    "launch_lag_s": "float32", "load": "float32", "start_ns": "int64", "end_ns": "int64",
+    "queue_s": "float32",
+}
+CACHE_VERSION = 2
+CHUNK_LINES = 500_000
+# Flow log names experiment.py writes per --log-format; flows.npz stands for
+# its flows.<chunk>.npz batches
+FLOW_LOGS = ("flows.jsonl", "flows.parquet", "flows.npz")
+
+def _compact(df):
+    for col, dtype in FLOW_DTYPES.items():
+        if col in df and not df[col].isna().any():
+            df[col] = df[col].astype(dtype)
+    if "intensity" in df:
+        # Flows/s steps are integers; load-based runs record fractional rates
+        inten = df["intensity"]
+        whole = (inten % 1 == 0).all()
+        df["intensity"] = inten.astype("int16" if whole else "float32")
+    return df
+
+def _concat(chunks):
+    if len(chunks) == 1:
+        return chunks[0]
+    cats = {c for c in chunks[0] if isinstance(chunks[0][c].dtype, pd.CategoricalDtype)}
+    merged = {c: union_categoricals([ch[c] for ch in chunks]) for c in cats}
+    df = pd.concat([ch.drop(columns=list(cats)) for ch in chunks], ignore_index=True)
+    for c in cats:
+        df[c] = pd.Categorical(merged[c])
+    return _compact(df)
+
+def flow_log_files(path):
+    """Files making up the flow log `path` (a .npz path stands for its batches)."""
+    if path.endswith(".npz"):
+        chunks = sorted(glob.glob(glob.escape(path[:-len(".npz")]) + ".*.npz"))
+        if chunks:
+            return chunks
+    return [path] if os.path.exists(path) else []
+
+def find_flow_log(attempt):
+    """The flow log of an attempt directory, whichever format it was written in."""
+    for name in FLOW_LOGS:
+        path = os.path.join(attempt, name)
+        if flow_log_files(path):
+            return path
+    return None
+
+def _columnar_chunks(path):
+    """Yields a parquet log, or each batch of an npz log, as a DataFrame."""
+    if path.endswith(".parquet"):
+        yield pd.read_parquet(path)
+        return
+    for p in flow_log_files(path):
+        with np.load(p) as z:
+            yield pd.DataFrame({k: z[k] for k in z.files})
+
+def parse_flows(path):
+    """Bulk-parses a flow log (jsonl in chunks, parquet, or npz batches),
+    compacting each chunk's dtypes."""
+    if path.endswith((".parquet", ".npz")):
+        chunks = [_compact(chunk) for chunk in _columnar_chunks(path)]
+    else:
+        reader = pd.read_json(path, lines=True, chunksize=CHUNK_LINES, dtype=False)
+        chunks = [_compact(chunk) for chunk in reader]
+    return _concat(chunks) if chunks else pd.DataFrame()
+
+def flow_records(path):
+    """Yields the records of a flow log as dicts; jsonl is streamed line by line."""
+    if not path.endswith((".parquet", ".npz")):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    for chunk in _columnar_chunks(path):
+        for record in chunk.to_dict("records"):
+            # Columnar formats fill fields a record lacked with NaN
+            yield {k: v for k, v in record.items() if not (isinstance(v, float) and math.isnan(v))}
+
+def _cache_key(path):
+    files = []
+    for p in flow_log_files(path):
+        st = os.stat(p)
+        files.append([os.path.basename(p), st.st_size, st.st_mtime_ns])
+    if not files:
+        raise FileNotFoundError(path)
+    return {"version": CACHE_VERSION, "files": files}
+
+def _read_cache(cache_dir, key):
+    try:
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("key") != key:
+        return None
+    try:
+        cols = {}
+        for col, info in meta["columns"].items():
+            arr = np.load(os.path.join(cache_dir, f"{col}.npy"), mmap_mode="r")
+            if "categories" in info:
+                arr = pd.Categorical.from_codes(arr, info["categories"])
+            cols[col] = arr
+        return pd.DataFrame(cols, copy=False)
+    except Exception as e:
+        # A damaged or unreadable cache (e.g. an object array from an older version) is a miss
+        print(f"[Cache] ignoring {cache_dir}: {e}")
+        return None
+
+def _write_cache(df, cache_dir, key):
+    tmp = cache_dir + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp, f"{col}.npy"), values.cat.codes.to_numpy())
+            columns[col] = {"categories": [str(c) for c in values.cat.categories]}
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            # String, mixed or nested fields (object or pandas' str dtype): keep them as
+            # strings so the cache stays pickle-free; missing values stay missing (code -1)
+            cat = values.astype(str).where(values.notna()).astype("category")
+            np.save(os.path.join(tmp, f"{col}.npy"), cat.cat.codes.to_numpy())
+            columns[col] = {"categories": list(cat.cat.categories)}
+        else:
+            np.save(os.path.join(tmp, f"{col}.npy"), values.to_numpy())
+            columns[col] = {"dtype": str(values.dtype)}
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({"key": key, "columns": columns}, f)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp, cache_dir)
+
+def load_flows(path="flows.jsonl", cache=True):
+    """Loads flow records as a compactly typed DataFrame.
+
+    `path` is a flows.jsonl, flows.parquet or flows.npz (the npz batches)
+    log. The parsed columns are cached in <path>.cache/ and reused
+    (memory-mapped) as long as the files' sizes and mtimes are unchanged.
+    """
+    if not cache:
+        return parse_flows(path)
+    cache_dir = path + ".cache"
+    key = _cache_key(path)
+    df = _read_cache(cache_dir, key)
+    if df is not None:
+        return df
+    df = parse_flows(path)
+    try:
+        _write_cache(df, cache_dir, key)
+    except OSError as e:
+        print(f"[Cache] not written for {path}: {e}")
+    return df
 
 def load_stats(path="stats.csv"):
     return pd.read_csv(path)
 
+def _finish(savefile):
+    if savefile:
+        plt.savefig(savefile)
+        plt.close()
+        print(f"[Saved] {savefile}")
+    else:
+        plt.show()
+
 # -------------------------------
 # Plot 1: CDF of FCT
 # -------------------------------
@@ -46,11 +219,7 @@ def plot_cdf(df, traffic_type, savefile=None):
     plt.grid(True)
     plt.legend(title="Intensity")
 
-    if savefile:
-        plt.savefig(savefile)
-        print(f"[Saved] {savefile}")
-    else:
-        plt.show()
+    _finish(savefile)
 
 # -------------------------------
 # Plot 2: Mean FCT vs Intensity
@@ -67,11 +236,7 @@ def plot_mean(stats_df, savefile=None):
     plt.grid(True)
     plt.legend()
 
-    if savefile:
-        plt.savefig(savefile)
-        print(f"[Saved] {savefile}")
-    else:
-        plt.show()
+    _finish(savefile)
 
 # -------------------------------
 # Plot 3: Percentiles vs Intensity
@@ -89,11 +254,7 @@ def plot_percentiles(stats_df, savefile=None):
     plt.grid(True)
     plt.legend()
 
-    if savefile:
-        plt.savefig(savefile)
-        print(f"[Saved] {savefile}")
-    else:
-        plt.show()
+    _finish(savefile)
 
 # -------------------------------
 # Plot 4: Boxplot with outliers
@@ -131,19 +292,193 @@ def plot_boxplot(df, savefile=None):
     plt.suptitle("Flow Completion Time Distribution (with Outliers)")
     plt.tight_layout()
 
-    if savefile:
-        plt.savefig(savefile)
-        print(f"[Saved] {savefile}")
-    else:
-        plt.show()
+    _finish(savefile)
 
+# -------------------------------
+# Comparison plots
+# -------------------------------
+def plot_compare(series, column, ylabel, title, savefile=None):
+    """One subplot per traffic type, one line per label.
+    `series` maps label -> stats DataFrame (traffic_type, intensity, column)."""
+    fig, axes = plt.subplots(1, 2, figsize=(14, 5), sharey=True)
+    for ax, traffic in zip(axes, ["WebSearch", "DataMining"]):
+        for label, stats_df in series.items():
+            subset = stats_df[stats_df["traffic_type"] == traffic].sort_values("intensity")
+            if len(subset):
+                ax.plot(subset["intensity"], subset[column], marker="o", label=label)
+        ax.set_title(traffic)
+        ax.set_xlabel("Traffic Intensity (flows/s)")
+        ax.grid(True)
+        ax.legend(fontsize="small")
+    axes[0].set_ylabel(ylabel)
+    plt.suptitle(title)
+    plt.tight_layout()
+    _finish(savefile)
+
+def stats_from_flows(flows_df):
+    """Mean/p95/p99 per type and intensity, in the stats.csv layout."""
+    g = flows_df.groupby(["traffic_type", "intensity"], observed=True)["fct_s"]
+    out = pd.DataFrame({"mean_fct": g.mean(), "p95_fct": g.quantile(0.95),
+                        "p99_fct": g.quantile(0.99)}).reset_index()
+    out["traffic_type"] = out["traffic_type"].map({1: "WebSearch", 2: "DataMining"})
+    return out
+
+# -------------------------------
+# Report
+# -------------------------------
+FIGURES = {
+    # name: (inputs, render(flows_df, stats_df, savefile)); "flows" is the flow log in any format
+    "cdf_websearch.png": (("flows",), lambda f, s, out: plot_cdf(f, 1, out)),
+    "cdf_datamining.png": (("flows",), lambda f, s, out: plot_cdf(f, 2, out)),
+    "mean_fct.png": (("stats.csv",), lambda f, s, out: plot_mean(s, out)),
+    "percentiles_fct.png": (("stats.csv",), lambda f, s, out: plot_percentiles(s, out)),
+    "boxplot_fct.png": (("flows",), lambda f, s, out: plot_boxplot(f, out)),
+}
+
+def find_attempts(root):
+    """Every directory below root holding a flow log or stats.csv."""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.endswith(".cache"))
+        if "stats.csv" in filenames or find_flow_log(dirpath):
+            found.append(dirpath)
+    return found
+
+def input_files(attempt, inputs):
+    """Files behind a figure's inputs, or None if any input is missing."""
+    files = []
+    for name in inputs:
+        path = find_flow_log(attempt) if name == "flows" else os.path.join(attempt, name)
+        found = flow_log_files(path) if path else []
+        if not found:
+            return None
+        files += found
+    return files
+
+def attempt_policy(attempt):
+    """Controller policy of an attempt: lb_policy from a sweep cell's
+    params.json or lb.conf, else rr (the controller default)."""
+    params = os.path.join(attempt, "params.json")
+    if os.path.exists(params):
+        with open(params) as f:
+            return json.load(f).get("lb_policy", "rr")
+    conf = os.path.join(attempt, "lb.conf")
+    if os.path.exists(conf):
+        with open(conf) as f:
+            for line in f:
+                key, _, value = line.partition("=")
+                if key.strip() == "lb_policy":
+                    return value.strip()
+    return "rr"
+
+def up_to_date(target, inputs):
+    """True when target exists and is newer than every input (and this script)."""
+    if not os.path.exists(target):
+        return False
+    newest = max(os.path.getmtime(p) for p in list(inputs) + [os.path.abspath(__file__)])
+    return os.path.getmtime(target) >= newest
+
+def _worker_init():
+    plt.switch_backend("Agg")
+
+def render_figure(attempt, name, savefile):
+    inputs, render = FIGURES[name]
+    flows_df = load_flows(find_flow_log(attempt)) if "flows" in inputs else None
+    stats_df = load_stats(os.path.join(attempt, "stats.csv")) if "stats.csv" in inputs else None
+    render(flows_df, stats_df, savefile)
+    return savefile
+
+def render_compare(attempts, root, column, ylabel, title, savefile):
+    series = {os.path.relpath(a, root): load_stats(os.path.join(a, "stats.csv")) for a in attempts}
+    plot_compare(series, column, ylabel, title, savefile)
+    return savefile
+
+def render_policy_compare(attempts, column, ylabel, title, savefile):
+    by_policy = {}
+    for a in attempts:
+        by_policy.setdefault(attempt_policy(a), []).append(load_flows(find_flow_log(a)))
+    series = {policy: stats_from_flows(pd.concat(frames, ignore_index=True))
+              for policy, frames in sorted(by_policy.items())}
+    plot_compare(series, column, ylabel, title, savefile)
+    return savefile
+
+def report(root="Attempts", out=None, jobs=None, force=False):
+    attempts = find_attempts(root)
+    out = out or root
+    os.makedirs(out, exist_ok=True)
+    tasks, skipped = [], 0
+
+    def want(target, inputs):
+        nonlocal skipped
+        if not force and up_to_date(target, inputs):
+            skipped += 1
+            return False
+        return True
+
+    for attempt in attempts:
+        # Per-attempt figures go next to their data, as in the original attempts
+        for name, (inputs, _) in FIGURES.items():
+            paths = input_files(attempt, inputs)
+            target = os.path.join(attempt, name)
+            if paths is not None and want(target, paths):
+                tasks.append((render_figure, attempt, name, target))
+
+    with_stats = [a for a in attempts if os.path.exists(os.path.join(a, "stats.csv"))]
+    if len(with_stats) > 1:
+        inputs = [os.path.join(a, "stats.csv") for a in with_stats]
+        for column, label in (("p99_fct", "99th percentile"), ("mean_fct", "Mean")):
+            target = os.path.join(out, f"compare_{column}.png")
+            if want(target, inputs):
+                tasks.append((render_compare, with_stats, root, column, f"{label} FCT (s)",
+                              f"{label} FCT across attempts", target))
+
+    with_flows = [a for a in attempts if find_flow_log(a)]
+    if len({attempt_policy(a) for a in with_flows}) > 1:
+        inputs = [p for a in with_flows for p in input_files(a, ("flows",))]
+        for column, label in (("p99_fct", "99th percentile"), ("mean_fct", "Mean")):
+            target = os.path.join(out, f"policy_{column}.png")
+            if want(target, inputs):
+                tasks.append((render_policy_compare, with_flows, column, f"{label} FCT (s)",
+                              f"{label} FCT by controller policy", target))
+
+    print(f"[Report] {len(attempts)} attempts, {len(tasks)} figures to render, {skipped} up to date")
+    if not tasks:
+        return
+    # Parse each flow log once up front so workers only ever hit the cache
+    for attempt in with_flows:
+        load_flows(find_flow_log(attempt))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_worker_init) as pool:
+        futures = [pool.submit(fn, *args) for fn, *args in tasks]
+        for fut in futures:
+            fut.result()
 
 # -------------------------------
 # Main
 # -------------------------------
 def main():
-    flows_df = load_flows("Attempts/Attempt_1(Low_Sizes)/flows.jsonl")
-    stats_df = load_stats("Attempts/Attempt_1(Low_Sizes)/stats.csv")
+    # "plot_result.py <attempt>" keeps working without the plot subcommand
+    if len(sys.argv) < 2 or sys.argv[1] not in ("plot", "report", "-h", "--help"):
+        sys.argv.insert(1, "plot")
+    ap = argparse.ArgumentParser(description="Plot Lab 2 results")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    single = sub.add_parser("plot", help="plot one attempt")
+    single.add_argument("attempt", nargs="?", default="Attempts/Attempt_1(Low_Sizes)",
+                        help="directory with a flow log (flows.jsonl, .parquet or .npz batches) and stats.csv")
+    single.add_argument("--no-cache", action="store_true", help="reparse the flow log, ignoring the cache")
+    rep = sub.add_parser("report", help="render every attempt and cross-attempt comparisons")
+    rep.add_argument("root", nargs="?", default="Attempts", help="directory searched for attempts")
+    rep.add_argument("--out", help="directory for comparison figures (default: root)")
+    rep.add_argument("-j", "--jobs", type=int, help="worker processes (default: CPU count)")
+    rep.add_argument("--force", action="store_true", help="re-render up-to-date figures too")
+    args = ap.parse_args()
+
+    if args.cmd == "report":
+        report(args.root, args.out, args.jobs, args.force)
+        return
+
+    flows_path = find_flow_log(args.attempt) or os.path.join(args.attempt, "flows.jsonl")
+    flows_df = load_flows(flows_path, cache=not args.no_cache)
+    stats_df = load_stats(os.path.join(args.attempt, "stats.csv"))
 
     # Plot 1 – CDFs
     plot_cdf(flows_df, 1, "cdf_websearch.png")
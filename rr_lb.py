@@ -6,23 +6,746 @@ Implements L3-style switching using Ryu and OpenFlow 1.3.
 Performs MAC learning and Round Robin load balancing
 for aggregation switches (s2, s4). Includes logging
 and flow timeouts for dynamic updates.
+
+Optionally balances the aggregation uplinks in the data plane with an
+OpenFlow SELECT group (lb_select_groups), so new flows are hashed onto
+an uplink by the switch instead of waiting for a packet_in round trip.
+
+A background monitor polls port and flow statistics so uplink selection
+can follow load (lb_policy = rr | least_loaded | p2c). With lb_reroute
+enabled, flows whose byte counters cross lb_elephant_bytes are treated as
+elephants and moved to the least-loaded uplink with a FlowMod MODIFY.
+
+Flow entries match host pairs, TCP/UDP 5-tuples or hashed 5-tuple buckets
+(lb_match); lb_max_flows bounds the fine-grained entries per switch.
+
+Packet-ins are decoded by a struct-based fast path (parse_headers) that
+only reads the fields the controller needs; the full ryu packet parser is
+used as a fallback for anything it does not understand.
+
+Switch roles and uplink ports are either the static lab values (s2/s4,
+ports 1-2) or learned from LLDP topology events (lb_topology = discover,
+run ryu-manager with --observe-links), which makes k-ary fat-trees work.
+
+Per-switch MAC and flow state lives in bounded AgingTables (LRU eviction
+plus TTL aging), so controller memory stays flat under host churn.
+
+Hot-path counters and histograms are served in Prometheus text format at
+http://<wsapi-host>:<wsapi-port>/metrics (Ryu WSGI, default port 8080).
+The WSGI server starts with every run and Ryu binds it to all interfaces
+by default, so start the controller with --wsapi-host 127.0.0.1.
 """
 
+import bisect
+import random
+import socket
+import struct
+import time
+from collections import OrderedDict, namedtuple
+
+from webob import Response
+
+from ryu import cfg
+from ryu.app.wsgi import ControllerBase, WSGIApplication, route
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
+from ryu.controller.handler import (CONFIG_DISPATCHER, MAIN_DISPATCHER,
+                                    DEAD_DISPATCHER, set_ev_cls)
+from ryu.lib import hub
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet, ethernet, ether_types, ipv4
+from ryu.topology import api as topo_api
+from ryu.topology import event as topo_event
+from ryu.lib.packet import packet, ethernet, ether_types, ipv4, tcp, udp, in_proto
+
+# ---------------------------
+# Configuration
+# Options are read from a ryu config file, e.g.
+#   ryu-manager --config-file lb.conf rr_lb.py
+# with a [DEFAULT] section containing "lb_select_groups = true".
+# ---------------------------
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.BoolOpt('lb_select_groups', default=False,
+                help='Install an OFPGT_SELECT group on aggregation switches '
+                     'and hash flows to uplinks in the data plane'),
+    cfg.ListOpt('lb_uplink_weights', default=[],
+                help='Bucket weights for the SELECT group, one per uplink '
+                     'port (e.g. "2,1"); empty means equal weights'),
+    cfg.StrOpt('lb_policy', default='rr',
+               help='Uplink selection policy: rr, least_loaded or p2c '
+                    '(power of two choices)'),
+    cfg.FloatOpt('lb_stats_interval', default=1.0,
+                 help='Seconds between port/flow statistics requests'),
+    cfg.FloatOpt('lb_util_alpha', default=0.5,
+                 help='EWMA weight of the newest utilization sample (0-1]'),
+    cfg.FloatOpt('lb_new_flow_bps', default=250_000,
+                 help='Load (bytes/s) assumed for each flow placed on an uplink '
+                      'since the last statistics reply'),
+    cfg.BoolOpt('lb_reroute', default=False,
+                help='Move elephant flows to the least-loaded uplink'),
+    cfg.IntOpt('lb_elephant_bytes', default=1_000_000,
+               help='Byte count above which a flow is treated as an elephant'),
+    cfg.FloatOpt('lb_reroute_holddown', default=2.0,
+                 help='Minimum seconds between two moves of the same flow'),
+    cfg.BoolOpt('lb_flowlet', default=False,
+                help='Only move an elephant during a lull in its sending rate, '
+                     'to avoid reordering packets in flight'),
+    cfg.FloatOpt('lb_flowlet_fraction', default=0.2,
+                 help='A lull is an interval whose byte delta is below this '
+                      'fraction of the previous interval'),
+    cfg.StrOpt('lb_match', default='host_pair',
+               help='Flow entry granularity: host_pair (IPv4 src/dst), '
+                    'five_tuple (plus protocol and TCP/UDP ports) or hashed '
+                    '(5-tuple bucketed on the low bits of the source port)'),
+    cfg.IntOpt('lb_hash_buckets', default=8,
+               help='Number of source-port buckets per host pair in hashed '
+                    'mode (power of two)'),
+    cfg.IntOpt('lb_max_flows', default=1000,
+               help='Maximum fine-grained flow entries per switch; beyond '
+                    'this new flows fall back to host-pair entries (0 = no limit)'),
+    cfg.StrOpt('lb_topology', default='static',
+               help='static: balance uplinks 1-2 of s2/s4 (the one-pod lab '
+                    'topology); discover: learn switch roles and uplink ports '
+                    'from LLDP (requires ryu-manager --observe-links)'),
+    cfg.IntOpt('lb_mac_table_size', default=4096,
+               help='Maximum learned MAC addresses per switch (LRU eviction)'),
+    cfg.FloatOpt('lb_mac_ttl', default=300.0,
+                 help='Seconds after which a MAC not seen again is forgotten'),
+    cfg.IntOpt('lb_flow_state_size', default=8192,
+               help='Maximum tracked flow placements per switch (LRU eviction)'),
+    cfg.FloatOpt('lb_flow_state_ttl', default=60.0,
+                 help='Seconds after which a flow placement is forgotten even '
+                      'if its flow-removed message was lost'),
+    cfg.IntOpt('lb_log_sample', default=100,
+               help='Log one in every N uplink decisions at INFO level '
+                    '(0 = never; 1 = every decision)'),
+    cfg.IntOpt('lb_miss_send_len', default=128,
+               help='Bytes of each table-miss packet sent to the controller; '
+                    'switches that can buffer keep the rest and return a '
+                    'buffer_id (0 = always send the full packet, no buffering)'),
+])
+
+LB_MATCH_MODES = ('host_pair', 'five_tuple', 'hashed')
+LB_TOPOLOGY_MODES = ('static', 'discover')
+
+LB_POLICIES = ('rr', 'least_loaded', 'p2c')
+
+# Static roles used when lb_topology = static
+AGGREGATION_SWITCHES = [2, 4]   # DPIDs of the aggregation switches (s2, s4)
+UPLINK_PORTS = [1, 2]           # Uplink ports on the aggregation switches
+UPLINK_GROUP_ID = 1             # Group ID of the SELECT group over a switch's uplinks
+INGRESS_GROUP_BASE = 0x100      # Group INGRESS_GROUP_BASE + p: the uplinks except ingress port p
+SWITCH_ROLES = ('edge', 'aggregation', 'core')
+
+# Flow priorities: table-miss < SELECT group defaults < learned MACs and host-pair flows < 5-tuple flows
+PRIORITY_TABLE_MISS = 0
+PRIORITY_GROUP = 1
+PRIORITY_FLOW = 2
+PRIORITY_MICROFLOW = 3
+
+# ---------------------------
+# Fast packet header decoding
+# ---------------------------
+# Only the fields used for forwarding decisions; ports are None for non-TCP/UDP packets
+Headers = namedtuple('Headers', 'eth_dst eth_src ethertype ip_src ip_dst ip_proto src_port dst_port')
+
+_ETH = struct.Struct('!6s6sH')
+_IPV4 = struct.Struct('!B8xB2x4s4s')   # version/IHL, protocol, src, dst
+_PORTS = struct.Struct('!HH')
+
+
+def parse_headers(data):
+    """Decode Ethernet, IPv4 and TCP/UDP ports straight from the packet buffer.
+
+    Returns None for frames the fast path does not handle (VLAN tags, IPv4
+    options cut off by miss_send_len, truncated frames) so the caller can fall
+    back to the full ryu parser.
+    """
+    buf = memoryview(data)
+    if len(buf) < _ETH.size:
+        return None
+    dst, src, ethertype = _ETH.unpack_from(buf)
+    eth_dst, eth_src = dst.hex(':'), src.hex(':')
+    if ethertype != ether_types.ETH_TYPE_IP:
+        if ethertype in (ether_types.ETH_TYPE_8021Q, ether_types.ETH_TYPE_8021AD):
+            return None
+        return Headers(eth_dst, eth_src, ethertype, None, None, None, None, None)
+
+    if len(buf) < _ETH.size + _IPV4.size:
+        return None
+    ver_ihl, proto, ip_src, ip_dst = _IPV4.unpack_from(buf, _ETH.size)
+    if ver_ihl >> 4 != 4:
+        return None
+    ip_src, ip_dst = socket.inet_ntoa(ip_src), socket.inet_ntoa(ip_dst)
+    src_port = dst_port = None
+    if proto in (in_proto.IPPROTO_TCP, in_proto.IPPROTO_UDP):
+        l4 = _ETH.size + (ver_ihl & 0x0F) * 4
+        if len(buf) < l4 + _PORTS.size:
+            return None
+        src_port, dst_port = _PORTS.unpack_from(buf, l4)
+    return Headers(eth_dst, eth_src, ethertype, ip_src, ip_dst, proto, src_port, dst_port)
+
+
+def parse_headers_full(data):
+    """Slow path: decode the same fields with the full ryu packet parser."""
+    pkt = packet.Packet(data)
+    eth = pkt.get_protocols(ethernet.ethernet)[0]
+    ip_pkt = pkt.get_protocol(ipv4.ipv4)
+    if ip_pkt is None:
+        return Headers(eth.dst, eth.src, eth.ethertype, None, None, None, None, None)
+    l4 = pkt.get_protocol(tcp.tcp) or pkt.get_protocol(udp.udp)
+    return Headers(eth.dst, eth.src, ether_types.ETH_TYPE_IP, ip_pkt.src, ip_pkt.dst,
+                   ip_pkt.proto, l4.src_port if l4 else None, l4.dst_port if l4 else None)
+
+
+# ---------------------------
+# Bounded state tables
+# ---------------------------
+class AgingTable(object):
+    """Dict-like table with a fixed capacity and a time-to-live.
+
+    Lookups move an entry to the most-recently-used end; inserting beyond
+    capacity evicts the least recently used entry. Entries older than
+    `ttl` seconds since they were last written are dropped on lookup or
+    by expire(). Counts evictions and expirations for monitoring.
+    """
+
+    def __init__(self, capacity, ttl, clock=time.monotonic):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()      # key -> (value, write time)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        entries = self._entries
+        entries[key] = (value, self.clock())
+        entries.move_to_end(key)
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if self.clock() - entry[1] > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            return default
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def items(self):
+        return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def expire(self):
+        """Drops every entry older than the TTL; returns how many were dropped."""
+        cutoff = self.clock() - self.ttl
+        stale = [key for key, (_, written) in self._entries.items() if written < cutoff]
+        for key in stale:
+            del self._entries[key]
+        self.expirations += len(stale)
+        return len(stale)
+
+    def stats(self):
+        return {"size": len(self._entries), "capacity": self.capacity,
+                "evictions": self.evictions, "expirations": self.expirations}
+
+_MISSING = object()
+
+
+# ---------------------------
+# Metrics
+# ---------------------------
+class Metrics(object):
+    """Minimal in-process counters, gauges and histograms rendered in the
+    Prometheus text exposition format. Updates are a dict lookup and an
+    add, cheap enough to leave on in the packet_in hot path."""
+
+    # Handler latency buckets in seconds (10 us .. 100 ms)
+    LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 1e-1)
+
+    def __init__(self):
+        self.counters = {}       # (name, labels) -> value
+        self.histograms = {}     # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.buckets = {}        # histogram name -> upper bounds
+        self.help = {}           # metric name -> (type, help text)
+        self.collectors = []     # callables returning [(name, labels, value)] gauge samples
+
+    def describe(self, name, kind, text, buckets=None):
+        self.help[name] = (kind, text)
+        if buckets is not None:
+            self.buckets[name] = buckets
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        bounds = self.buckets[name]
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = [0] * (len(bounds) + 2)
+        hist[bisect.bisect_left(bounds, value)] += 1
+        hist[-1] += value
+
+    def render(self):
+        lines, seen = [], set()
+
+        def header(name):
+            if name not in seen and name in self.help:
+                seen.add(name)
+                kind, text = self.help[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        def fmt(labels, extra=()):
+            pairs = tuple(labels) + tuple(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name)
+            lines.append(f"{name}{fmt(labels)} {value}")
+        for (name, labels), hist in sorted(self.histograms.items()):
+            header(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets[name] + (float("inf"),), hist[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{fmt(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{fmt(labels)} {hist[-1]}")
+            lines.append(f"{name}_count{fmt(labels)} {cumulative}")
+        for collect in self.collectors:
+            for name, labels, value in sorted(collect()):
+                header(name)
+                lines.append(f"{name}{fmt(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+LB_APP_INSTANCE = 'rr_lb_app'
+
+
+class MetricsController(ControllerBase):
+    """Serves RoundRobinLB.metrics at GET /metrics."""
+
+    def __init__(self, req, link, data, **config):
+        super(MetricsController, self).__init__(req, link, data, **config)
+        self.app = data[LB_APP_INSTANCE]
+
+    @route('lb_metrics', '/metrics', methods=['GET'])
+    def metrics(self, req, **kwargs):
+        return Response(content_type='text/plain', charset='utf-8',
+                        text=self.app.metrics.render())
 
 
 class RoundRobinLB(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _CONTEXTS = {'wsgi': WSGIApplication}
 
     def __init__(self, *args, **kwargs):
         super(RoundRobinLB, self).__init__(*args, **kwargs)
-        self.mac_to_port = {}          # Maps each MAC address to its port
+        self.mac_to_port = {}          # dpid -> AgingTable mapping each MAC address to its port
         self.rr_counter = {}           # Keeps track of which uplink port to use next
-        self.logger.info("[Init] RoundRobinLB started.")
+        self.use_groups = CONF.lb_select_groups
+        if CONF.lb_topology not in LB_TOPOLOGY_MODES:
+            raise ValueError(f"lb_topology must be one of {LB_TOPOLOGY_MODES}, got {CONF.lb_topology!r}")
+        self.topology = CONF.lb_topology
+        self.uplinks = {}              # dpid -> uplink ports balanced by the selection policy
+        self.local_ports = {}          # dpid -> host/downlink ports (discovered topology only)
+        self.roles = {}                # dpid -> 'edge' | 'aggregation' | 'core'
+        self.linked = set()            # dpids with at least one discovered switch link (discovered topology only)
+        self.topology_links = 0        # discovered switch-to-switch links, one per direction
+        if self.topology == 'static':
+            # Fail early on a weight list that does not fit the static uplinks
+            self._parse_weights(CONF.lb_uplink_weights, len(UPLINK_PORTS))
+            for dpid in AGGREGATION_SWITCHES:
+                self.uplinks[dpid] = list(UPLINK_PORTS)
+                self.roles[dpid] = 'aggregation'
+        if CONF.lb_policy not in LB_POLICIES:
+            raise ValueError(f"lb_policy must be one of {LB_POLICIES}, got {CONF.lb_policy!r}")
+        self.policy = CONF.lb_policy
+        if CONF.lb_match not in LB_MATCH_MODES:
+            raise ValueError(f"lb_match must be one of {LB_MATCH_MODES}, got {CONF.lb_match!r}")
+        buckets = CONF.lb_hash_buckets
+        if buckets < 1 or buckets & (buckets - 1):
+            raise ValueError(f"lb_hash_buckets must be a power of two, got {buckets}")
+        self.match_mode = CONF.lb_match
+        self.microflows = {}           # dpid -> match keys of installed fine-grained (5-tuple/hashed) flow entries
+        self.datapaths = {}            # Connected switches, polled by the monitor thread
+        self.port_bytes = {}           # (dpid, port) -> (tx_bytes, duration in seconds) of last reply
+        self.port_util = {}            # (dpid, port) -> EWMA of transmitted bytes/s
+        self.placed = {}               # (dpid, port) -> flows placed since the last port stats reply
+        self.flow_bytes = {}           # dpid -> {match key: (byte_count, bytes/s, duration)} from the last flow stats reply
+        self.flow_stats_parts = {}     # dpid -> flow stats entries of a multipart reply still in progress
+        self.placements = {}           # dpid -> AgingTable {match key: [match, priority, uplink port, other ports, last move time, ingress port]}
+        self.decisions = 0             # Uplink decisions made, used for log sampling
+        self.metrics = Metrics()
+        self._describe_metrics()
+        wsgi = kwargs.get('wsgi')
+        if wsgi is not None:
+            wsgi.register(MetricsController, {LB_APP_INSTANCE: self})
+        self.monitor_thread = hub.spawn(self._monitor)
+        self.logger.info(f"[Init] RoundRobinLB started (select_groups={self.use_groups}, "
+                         f"policy={self.policy}, topology={self.topology}).")
+
+    # ---------------------------
+    # Parse uplink weights
+    # Description: Converts the lb_uplink_weights option into one weight per uplink port
+    # Parameters:
+    # - weights: list of strings from the config file (may be empty)
+    # - count: number of uplink ports the weights are for
+    # ---------------------------
+    @staticmethod
+    def _parse_weights(weights, count):
+        if not weights:
+            return [1] * count
+        if len(weights) != count:
+            raise ValueError(f"lb_uplink_weights needs {count} values, got {weights}")
+        return [int(w) for w in weights]
+
+    # ---------------------------
+    # Topology discovery
+    # Description: Recomputes switch roles and uplink ports from the switches and
+    # links reported by ryu's LLDP-based topology discovery.
+    # - edge: has host-facing ports (ports without a switch link)
+    # - aggregation/core: one/two or more switch hops away from the edge tier
+    # A switch's uplinks are its ports towards the next tier up. The top tier has
+    # no uplinks and only forwards downwards.
+    # Parameters:
+    # - ev: any switch or link event
+    # ---------------------------
+    @set_ev_cls([topo_event.EventSwitchEnter, topo_event.EventSwitchLeave,
+                 topo_event.EventLinkAdd, topo_event.EventLinkDelete])
+    def _topology_change_handler(self, ev):
+        if self.topology != 'discover':
+            return
+        ports = {sw.dp.id: {p.port_no for p in sw.ports} for sw in topo_api.get_switch(self, None)}
+        neighbors = {dpid: {} for dpid in ports}   # dpid -> {port: neighbour dpid}
+        for link in topo_api.get_link(self, None):
+            if link.src.dpid in ports and link.dst.dpid in ports:
+                neighbors[link.src.dpid][link.src.port_no] = link.dst.dpid
+
+        # Breadth-first search upwards from the edge tier
+        tier = {dpid: 0 for dpid in ports if ports[dpid] - set(neighbors[dpid])}
+        frontier = list(tier)
+        while frontier:
+            next_frontier = []
+            for dpid in frontier:
+                for peer in neighbors[dpid].values():
+                    if peer not in tier:
+                        tier[peer] = tier[dpid] + 1
+                        next_frontier.append(peer)
+            frontier = next_frontier
+
+        uplinks, local_ports, roles = {}, {}, {}
+        for dpid, t in tier.items():
+            uplinks[dpid] = sorted(p for p, peer in neighbors[dpid].items() if tier.get(peer, -1) > t)
+            local_ports[dpid] = sorted(ports[dpid] - set(uplinks[dpid]))
+            roles[dpid] = SWITCH_ROLES[min(t, len(SWITCH_ROLES) - 1)]
+
+        changed = [dpid for dpid in uplinks if uplinks[dpid] != self.uplinks.get(dpid)]
+        self.uplinks, self.local_ports, self.roles = uplinks, local_ports, roles
+        self.linked = {dpid for dpid, peers in neighbors.items() if peers}
+        self.topology_links = sum(len(peers) for peers in neighbors.values())
+        for dpid in changed:
+            self.rr_counter.setdefault(dpid, 0)
+            datapath = self.datapaths.get(dpid)
+            if self.use_groups and datapath is not None and uplinks[dpid]:
+                self.add_uplink_group(datapath, uplinks[dpid], default_entry=False)
+        if changed:
+            self.logger.info(f"[Topology] {len(roles)} switches: " + ", ".join(
+                f"{dpid}={roles[dpid]} up={uplinks[dpid]}" for dpid in sorted(roles)))
+
+    # ---------------------------
+    # Metrics setup
+    # Description: Declares the exported metrics and registers a collector that
+    # samples table sizes and uplink utilization when /metrics is scraped
+    # ---------------------------
+    def _describe_metrics(self):
+        m = self.metrics
+        m.describe('lb_packet_in_total', 'counter', 'PacketIn events handled per switch')
+        m.describe('lb_packet_in_seconds', 'histogram', 'PacketIn handler latency',
+                   buckets=Metrics.LATENCY_BUCKETS)
+        m.describe('lb_flow_mod_total', 'counter', 'FlowMod messages sent per switch')
+        m.describe('lb_group_mod_total', 'counter', 'GroupMod messages sent per switch')
+        m.describe('lb_packet_out_total', 'counter', 'PacketOut messages sent per switch')
+        m.describe('lb_uplink_selected_total', 'counter', 'Uplink decisions per switch and port')
+        m.describe('lb_reroute_total', 'counter', 'Elephant flows moved per switch')
+        m.describe('lb_table_entries', 'gauge', 'Entries in the controller state tables')
+        m.describe('lb_table_evictions_total', 'counter', 'LRU evictions from the state tables')
+        m.describe('lb_table_expirations_total', 'counter', 'TTL expirations from the state tables')
+        m.describe('lb_microflow_entries', 'gauge', 'Fine-grained flow entries installed per switch')
+        m.describe('lb_port_tx_bytes_per_second', 'gauge', 'EWMA transmit rate per switch port')
+        m.describe('lb_topology_links', 'gauge', 'Switch-to-switch links discovered via LLDP, one per direction')
+        m.collectors.append(self._collect_gauges)
+
+    def _collect_gauges(self):
+        samples = []
+        for table, tables in self.table_stats().items():
+            for dpid, st in tables.items():
+                labels = (('table', table), ('dpid', dpid))
+                samples.append(('lb_table_entries', labels, st['size']))
+                samples.append(('lb_table_evictions_total', labels, st['evictions']))
+                samples.append(('lb_table_expirations_total', labels, st['expirations']))
+        for dpid, keys in self.microflows.items():
+            samples.append(('lb_microflow_entries', (('dpid', dpid),), len(keys)))
+        for (dpid, port), rate in self.port_util.items():
+            samples.append(('lb_port_tx_bytes_per_second', (('dpid', dpid), ('port', port)), round(rate, 1)))
+        if self.topology == 'discover':
+            samples.append(('lb_topology_links', (), self.topology_links))
+        return samples
+
+    # ---------------------------
+    # Switch state tracking
+    # Description: Keeps the set of connected switches up to date for the monitor thread
+    # EventOFPStateChange : This event is triggered when a switch connects or disconnects
+    # Parameters:
+    # - ev: the event message containing the datapath and its new state
+    # ---------------------------
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        datapath = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER and datapath.id in self.datapaths:
+            del self.datapaths[datapath.id]
+            self.flow_bytes.pop(datapath.id, None)
+            self.flow_stats_parts.pop(datapath.id, None)
+            self.placements.pop(datapath.id, None)
+            self.mac_to_port.pop(datapath.id, None)
+            self.rr_counter.pop(datapath.id, None)
+            self.microflows.pop(datapath.id, None)
+            for key in [k for k in self.port_util if k[0] == datapath.id]:
+                self.port_util.pop(key, None)
+                self.port_bytes.pop(key, None)
+                self.placed.pop(key, None)
+
+    # ---------------------------
+    # Statistics monitor
+    # Description: Background hub thread that periodically requests port and flow
+    # statistics from every connected switch
+    # ---------------------------
+    def _monitor(self):
+        while True:
+            for datapath in list(self.datapaths.values()):
+                self._request_stats(datapath)
+            self._expire_tables()
+            hub.sleep(CONF.lb_stats_interval)
+
+    # ---------------------------
+    # State table maintenance
+    # Description: Ages out stale MAC and flow placement entries and reports
+    # table occupancy/eviction counters per switch
+    # ---------------------------
+    def _expire_tables(self):
+        for tables in (self.mac_to_port, self.placements):
+            for table in tables.values():
+                table.expire()
+
+    def table_stats(self):
+        return {"mac_to_port": {dpid: t.stats() for dpid, t in self.mac_to_port.items()},
+                "placements": {dpid: t.stats() for dpid, t in self.placements.items()}}
+
+    def _mac_table(self, dpid):
+        table = self.mac_to_port.get(dpid)
+        if table is None:
+            table = self.mac_to_port[dpid] = AgingTable(CONF.lb_mac_table_size, CONF.lb_mac_ttl)
+        return table
+
+    def _placement_table(self, dpid):
+        table = self.placements.get(dpid)
+        if table is None:
+            table = self.placements[dpid] = AgingTable(CONF.lb_flow_state_size,
+                                                       CONF.lb_flow_state_ttl)
+        return table
+
+    def _request_stats(self, datapath):
+        parser = datapath.ofproto_parser
+        ofproto = datapath.ofproto
+        datapath.send_msg(parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY))
+        datapath.send_msg(parser.OFPFlowStatsRequest(datapath))
+
+    # ---------------------------
+    # Port statistics reply
+    # Description: Turns the cumulative tx_bytes counters into a rolling
+    # per-port utilization estimate (EWMA of bytes/s)
+    # Parameters:
+    # - ev: the event message containing one entry per port
+    # ---------------------------
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        alpha = CONF.lb_util_alpha
+        for stat in ev.msg.body:
+            key = (dpid, stat.port_no)
+            now = stat.duration_sec + stat.duration_nsec / 1e9
+            prev = self.port_bytes.get(key)
+            self.port_bytes[key] = (stat.tx_bytes, now)
+            if prev is None or now <= prev[1]:
+                continue
+            rate = (stat.tx_bytes - prev[0]) / (now - prev[1])
+            old = self.port_util.get(key)
+            self.port_util[key] = rate if old is None else alpha * rate + (1 - alpha) * old
+            # The new sample already reflects flows placed before it was taken
+            self.placed[key] = 0
+
+    # ---------------------------
+    # Flow statistics reply
+    # Description: Stores the byte counter and rate of every installed IPv4 flow,
+    # forgets placements whose flow has expired and, if lb_reroute is enabled,
+    # moves elephant flows off overloaded uplinks
+    # Large tables arrive in several parts (OFPMPF_REPLY_MORE set on all but the
+    # last); the parts are collected and processed together after the last one
+    # Parameters:
+    # - ev: the event message containing one entry per flow
+    # ---------------------------
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        datapath = ev.msg.datapath
+        dpid = datapath.id
+        parts = self.flow_stats_parts.setdefault(dpid, [])
+        parts.extend(ev.msg.body)
+        if ev.msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+        del self.flow_stats_parts[dpid]
+        previous = self.flow_bytes.get(dpid, {})
+        counters = {}
+        for stat in parts:
+            if stat.priority not in (PRIORITY_FLOW, PRIORITY_MICROFLOW):
+                continue
+            key = self._match_key(stat.match)
+            duration = stat.duration_sec + stat.duration_nsec / 1e9
+            old_bytes, _, old_duration = previous.get(key, (0, 0.0, 0.0))
+            elapsed = duration - old_duration
+            rate = (stat.byte_count - old_bytes) / elapsed if elapsed > 0 else 0.0
+            counters[key] = (stat.byte_count, rate, duration)
+        self.flow_bytes[dpid] = counters
+
+        # Drop placements whose flow entry timed out on the switch
+        placements = self.placements.get(dpid, {})
+        for key in [k for k in placements if k not in counters]:
+            del placements[key]
+
+        if CONF.lb_reroute and placements:
+            self._reroute_elephants(datapath, previous, counters)
+
+    # ---------------------------
+    # Elephant rerouting
+    # Description: Moves at most one elephant per statistics round from the most
+    # loaded uplink to the least loaded one, and only if the move actually
+    # narrows the gap between them
+    # Parameters:
+    # - datapath: the aggregation switch whose flows are inspected
+    # - previous: flow counters from the previous statistics reply
+    # - counters: flow counters from the current statistics reply
+    # ---------------------------
+    def _reroute_elephants(self, datapath, previous, counters):
+        dpid = datapath.id
+        placements = self.placements[dpid]
+        now = time.monotonic()
+        uplinks = self.uplinks.get(dpid)
+        if not uplinks:
+            return
+
+        # Largest movers first: heaviest current rate
+        elephants = sorted(
+            ((counters[key][1], key, entry) for key, entry in placements.items()
+             if counters[key][0] >= CONF.lb_elephant_bytes
+             and now - entry[4] >= CONF.lb_reroute_holddown),
+            key=lambda item: item[0], reverse=True)
+        for rate, key, (match, priority, port, other_ports, _, in_port) in elephants:
+            # Never move a flow back out of its ingress port: OpenFlow drops that output
+            choices = [p for p in uplinks if p != port and p != in_port]
+            if not choices:
+                continue
+            target = min(choices, key=lambda p: self._uplink_load(dpid, p))
+            target_load = self._uplink_load(dpid, target)
+            # Moving only helps if the source stays at least as loaded as the target
+            if self._uplink_load(dpid, port) - rate < target_load + rate:
+                continue
+            if CONF.lb_flowlet:
+                # Polling cannot see sub-millisecond gaps; a sharp drop in the
+                # per-interval byte delta is used as the flowlet boundary instead
+                prev_rate = previous.get(key, (0, 0.0, 0.0))[1]
+                if prev_rate == 0 or rate > CONF.lb_flowlet_fraction * prev_rate:
+                    continue
+            self.modify_flow(datapath, priority, match, other_ports + [target])
+            placements[key] = [match, priority, target, other_ports, now, in_port]
+            # Shift the estimate now instead of waiting for the next port stats reply
+            self.port_util[(dpid, port)] = max(self.port_util.get((dpid, port), 0.0) - rate, 0.0)
+            self.port_util[(dpid, target)] = self.port_util.get((dpid, target), 0.0) + rate
+            self.metrics.inc('lb_reroute_total', (('dpid', dpid),))
+            self.logger.info(f"[Reroute] Switch={dpid} elephant {dict(key)} "
+                             f"port {port} -> {target} ({rate:.0f} B/s)")
+            break
+
+    @staticmethod
+    def _match_key(match):
+        return tuple(sorted(match.items()))
+
+    # ---------------------------
+    # Uplink selection
+    # Description: Picks the uplink for a new flow according to lb_policy
+    # - rr: cycle through the uplinks
+    # - least_loaded: lowest estimated load
+    # - p2c: lowest estimated load among two random uplinks
+    # Parameters:
+    # - dpid: the switch making the decision (must have uplinks)
+    # - in_port: the packet's ingress port, never chosen (OpenFlow drops output to in_port)
+    # Returns: the uplink, or None if the ingress port is the only one
+    # ---------------------------
+    def _uplink_load(self, dpid, port):
+        key = (dpid, port)
+        return self.port_util.get(key, 0.0) + self.placed.get(key, 0) * CONF.lb_new_flow_bps
+
+    def _select_uplink(self, dpid, in_port=None):
+        uplink_ports = [port for port in self.uplinks[dpid] if port != in_port]
+        if not uplink_ports:
+            return None
+        if self.policy == 'least_loaded':
+            # Rotate the start so that ties are still broken round robin
+            start = self.rr_counter[dpid] % len(uplink_ports)
+            candidates = uplink_ports[start:] + uplink_ports[:start]
+        elif self.policy == 'p2c':
+            candidates = random.sample(uplink_ports, min(2, len(uplink_ports)))
+        else:
+            candidates = [uplink_ports[self.rr_counter[dpid] % len(uplink_ports)]]
+        out_port = min(candidates, key=lambda port: self._uplink_load(dpid, port))
+        # Update the counter and remember the placement until the next stats reply
+        self.rr_counter[dpid] += 1
+        self.placed[(dpid, out_port)] = self.placed.get((dpid, out_port), 0) + 1
+        self.metrics.inc('lb_uplink_selected_total', (('dpid', dpid), ('port', out_port)))
+        # Per-decision logging is sampled: formatting a log line per packet_in costs throughput
+        self.decisions += 1
+        if CONF.lb_log_sample and self.decisions % CONF.lb_log_sample == 0:
+            self.logger.info(f"[LB] Switch={dpid} policy={self.policy} selected uplink={out_port} "
+                             f"(decision {self.decisions})")
+        return out_port
 
     # ---------------------------
     # install flow rule 
@@ -35,9 +758,10 @@ class RoundRobinLB(app_manager.RyuApp):
     # - buffer_id: the buffer ID for the flow (optional)
     # - idle: idle timeout for the flow (default: 10 seconds)
     # - hard: hard timeout for the flow (default: 30 seconds)
+    # - flags: OFPFF_* flags, e.g. OFPFF_SEND_FLOW_REM to be told when the flow expires
     # ---------------------------
     def add_flow(self, datapath, priority, match, actions, buffer_id=None,
-                 idle=10, hard=30):
+                 idle=10, hard=30, flags=0):
         # Get parser for the datapath
         parser = datapath.ofproto_parser
         # Construct flow mod message and send it to datapath
@@ -45,20 +769,157 @@ class RoundRobinLB(app_manager.RyuApp):
         # Create instruction to apply actions
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
         # Create flow mod message
-        if buffer_id:
+        if buffer_id is not None and buffer_id != ofproto.OFP_NO_BUFFER:
             # Use buffer_id if provided
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
                                     priority=priority, idle_timeout=idle,
-                                    hard_timeout=hard, match=match,
+                                    hard_timeout=hard, flags=flags, match=match,
                                     instructions=inst)
         else:
             # Otherwise, create flow mod without buffer_id
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
                                     idle_timeout=idle, hard_timeout=hard,
-                                    match=match, instructions=inst)
+                                    flags=flags, match=match, instructions=inst)
         # Send flow mod message to datapath
         datapath.send_msg(mod)
-        self.logger.debug(f"[Flow Added] DPID={datapath.id}, Match={match}, Actions={actions}")
+        self.metrics.inc('lb_flow_mod_total', (('dpid', datapath.id),))
+        self.logger.debug("[Flow Added] DPID=%s, Match=%s, Actions=%s", datapath.id, match, actions)
+
+    # ---------------------------
+    # install SELECT group
+    # Description: Installs an OFPGT_SELECT group with one bucket per uplink port
+    # and (optionally) permanent per-ingress IPv4 flows pointing at groups, so the
+    # switch hashes new flows onto the uplinks without asking the controller.
+    # Parameters:
+    # - datapath: the switch to install the group on
+    # - ports: its uplink ports
+    # - default_entry: also install the default IPv4 entries (static topology only;
+    #   with a discovered topology, flows arriving from above must not go back up)
+    # ---------------------------
+    def add_uplink_group(self, datapath, ports, default_entry=True):
+        parser = datapath.ofproto_parser
+        weights = CONF.lb_uplink_weights
+        weights = self._parse_weights(weights, len(ports)) if len(weights) in (0, len(ports)) else [1] * len(ports)
+        weight_of = dict(zip(ports, weights))
+        self._install_select_group(datapath, UPLINK_GROUP_ID, ports, weight_of)
+        if default_entry:
+            # Default IPv4 entries, one per ingress uplink: OpenFlow never outputs a packet
+            # to its in_port, so each points at a group without the port it arrived on
+            for in_port in ports:
+                others = [p for p in ports if p != in_port]
+                if not others:
+                    continue
+                group_id = INGRESS_GROUP_BASE + in_port
+                self._install_select_group(datapath, group_id, others, weight_of)
+                match = parser.OFPMatch(in_port=in_port, eth_type=ether_types.ETH_TYPE_IP)
+                actions = [parser.OFPActionGroup(group_id)]
+                self.add_flow(datapath, PRIORITY_GROUP, match, actions, idle=0, hard=0)
+        self.logger.info(f"[Group] Switch={datapath.id} SELECT group over ports "
+                         f"{ports} weights={weights}")
+
+    def _install_select_group(self, datapath, group_id, ports, weight_of):
+        parser = datapath.ofproto_parser
+        ofproto = datapath.ofproto
+        # One bucket per uplink; watch_port lets the switch skip a bucket whose port is down
+        buckets = [parser.OFPBucket(weight=weight_of[port], watch_port=port,
+                                    watch_group=ofproto.OFPG_ANY,
+                                    actions=[parser.OFPActionOutput(port)])
+                   for port in ports]
+        # Remove any group left over from a previous connection, ADD fails if it exists
+        datapath.send_msg(parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE,
+                                             ofproto.OFPGT_SELECT, group_id))
+        datapath.send_msg(parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD,
+                                             ofproto.OFPGT_SELECT, group_id, buckets))
+        self.metrics.inc('lb_group_mod_total', (('dpid', datapath.id),), 2)
+
+    # ---------------------------
+    # Group for a packet_in
+    # Description: The SELECT group a packet may be handed to: the one without its
+    # ingress port when it arrived on an uplink, otherwise the group over all uplinks
+    # Parameters:
+    # - dpid: the switch
+    # - in_port: the packet's ingress port
+    # ---------------------------
+    def _uplink_group(self, dpid, in_port):
+        if self.topology == 'static' and in_port in self.uplinks.get(dpid, ()):
+            return INGRESS_GROUP_BASE + in_port
+        return UPLINK_GROUP_ID
+
+    # ---------------------------
+    # modify flow rule
+    # Description: Changes the output ports of an installed flow in place (MODIFY_STRICT),
+    # keeping its timeouts and counters
+    # Parameters:
+    # - datapath: the switch holding the flow
+    # - priority: the priority the flow was installed with
+    # - match: the exact match of the flow to modify
+    # - out_ports: the new output ports
+    # ---------------------------
+    def modify_flow(self, datapath, priority, match, out_ports):
+        parser = datapath.ofproto_parser
+        ofproto = datapath.ofproto
+        actions = [parser.OFPActionOutput(port) for port in out_ports]
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_MODIFY_STRICT,
+                                priority=priority, match=match, instructions=inst)
+        datapath.send_msg(mod)
+        self.metrics.inc('lb_flow_mod_total', (('dpid', datapath.id),))
+
+    # ---------------------------
+    # Build flow match
+    # Description: Builds the match for a new IPv4 flow according to lb_match.
+    # Falls back to a host-pair match for non-TCP/UDP packets and when the
+    # switch already holds lb_max_flows fine-grained entries.
+    # Parameters:
+    # - parser: the datapath's ofproto_parser
+    # - dpid: the switch the flow is installed on
+    # - hdr: the decoded packet headers (Headers)
+    # Returns: (match, priority)
+    # ---------------------------
+    def _build_match(self, parser, dpid, hdr):
+        fields = dict(eth_type=ether_types.ETH_TYPE_IP,
+                      ipv4_src=hdr.ip_src, ipv4_dst=hdr.ip_dst)
+        if self.match_mode == 'host_pair':
+            return parser.OFPMatch(**fields), PRIORITY_FLOW
+        if CONF.lb_max_flows and len(self.microflows.get(dpid, ())) >= CONF.lb_max_flows:
+            return parser.OFPMatch(**fields), PRIORITY_FLOW
+
+        if hdr.ip_proto == in_proto.IPPROTO_TCP and hdr.src_port is not None:
+            prefix = 'tcp'
+        elif hdr.ip_proto == in_proto.IPPROTO_UDP and hdr.src_port is not None:
+            prefix = 'udp'
+        else:
+            return parser.OFPMatch(**fields), PRIORITY_FLOW
+
+        fields['ip_proto'] = hdr.ip_proto
+        if self.match_mode == 'five_tuple':
+            fields[f'{prefix}_src'] = hdr.src_port
+            fields[f'{prefix}_dst'] = hdr.dst_port
+        else:
+            # OpenFlow cannot match on a hash, but ephemeral source ports are
+            # effectively random, so their low bits make a good bucket index
+            mask = CONF.lb_hash_buckets - 1
+            fields[f'{prefix}_src'] = (hdr.src_port & mask, mask)
+            fields[f'{prefix}_dst'] = hdr.dst_port
+        return parser.OFPMatch(**fields), PRIORITY_MICROFLOW
+
+    # ---------------------------
+    # Flow removal
+    # Description: Keeps the per-switch microflow set, placement table and flow
+    # counters in sync with flows that expired on the switch
+    # EventOFPFlowRemoved : This event is triggered when a flow installed with OFPFF_SEND_FLOW_REM is removed
+    # Parameters:
+    # - ev: the event message containing the removed flow
+    # ---------------------------
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        key = self._match_key(msg.match)
+        if msg.priority == PRIORITY_MICROFLOW:
+            self.microflows.get(dpid, set()).discard(key)
+        self.placements.get(dpid, {}).pop(key, None)
+        self.flow_bytes.get(dpid, {}).pop(key, None)
 
     # ---------------------------
     # Switch connection
@@ -77,12 +938,25 @@ class RoundRobinLB(app_manager.RyuApp):
         match = parser.OFPMatch()
         # Table-miss: send to controller
         # Why is priority 0? Table-miss flow entries must have the lowest priority to ensure they match packets that do not match any other flow entries.
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                          ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, 0, match, actions)
+        # Sending only the headers lets a buffering switch keep the payload; the FlowMod then releases it by buffer_id.
+        # A switch without buffers (n_buffers = 0) would hand over truncated frames, so it always sends the full packet
+        if CONF.lb_miss_send_len and (ev.msg.n_buffers or 0) > 0:
+            max_len = CONF.lb_miss_send_len
+        else:
+            max_len = ofproto.OFPCML_NO_BUFFER
+        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER, max_len)]
+        self.add_flow(datapath, PRIORITY_TABLE_MISS, match, actions)
         self.rr_counter[datapath.id] = 0
+        # Let aggregation switches balance uplinks themselves when SELECT groups are enabled
+        # (with a discovered topology the group is installed once the uplinks are known)
+        if self._has_group_entries(datapath.id):
+            self.add_uplink_group(datapath, self.uplinks[datapath.id])
         self.logger.info(f"[Switch Connected] Switch {datapath.id}")
 
+    def _has_group_entries(self, dpid):
+        """True for switches whose default IPv4 entries point at SELECT groups."""
+        return self.use_groups and self.topology == 'static' and dpid in self.uplinks
+
     # ---------------------------
     # Main packet handling
     # Description: Handles incoming packets and performs MAC learning and Round Robin load balancing
@@ -92,71 +966,142 @@ class RoundRobinLB(app_manager.RyuApp):
     # ---------------------------
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        # Count and time every packet_in; the actual work happens in _handle_packet_in
+        start = time.perf_counter()
+        self._handle_packet_in(ev)
+        labels = (('dpid', ev.msg.datapath.id),)
+        self.metrics.inc('lb_packet_in_total', labels)
+        self.metrics.observe('lb_packet_in_seconds', time.perf_counter() - start, labels)
+
+    def _handle_packet_in(self, ev):
         msg = ev.msg
         datapath = msg.datapath
         parser = datapath.ofproto_parser
         ofproto = datapath.ofproto
         # Get the input port from the message
         in_port = msg.match['in_port']
-        # Parse the packet
-        pkt = packet.Packet(msg.data)
-        # Get the Ethernet protocol part of the packet (e.g., src/dst MAC)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        # Parse the packet headers (src/dst MAC, ethertype, IPs and L4 ports)
+        # Why not packet.Packet? Decoding every layer into objects is the most expensive part of the
+        # handler; the fast path only unpacks the fields we need and falls back for anything unusual.
+        hdr = parse_headers(msg.data) or parse_headers_full(msg.data)
 
         # Skip LLDP
         # Why skip LLDP? LLDP packets are used for network topology discovery and should not be processed for forwarding decisions.
         # What is LLDP? Link Layer Discovery Protocol (LLDP) is a protocol used by network devices to advertise their identity and capabilities to neighboring devices.
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if hdr.ethertype == ether_types.ETH_TYPE_LLDP:
             return
 
         # Get source and destination MAC addresses
-        dst, src = eth.dst, eth.src
+        dst, src = hdr.eth_dst, hdr.eth_src
         # Get datapath ID to identify the switch
         dpid = datapath.id
-        # Initialize mac_to_port for this switch if not already done
-        self.mac_to_port.setdefault(dpid, {})
+        # Until LLDP has found one of its links, a switch in a discovered topology cannot tell
+        # host ports from switch ports; flooding then would loop through the fat-tree, so drop
+        if self.topology == 'discover' and dpid not in self.linked:
+            return
+        # Get (or create) the bounded MAC table for this switch
+        mac_table = self._mac_table(dpid)
 
         # Learn the source MAC to avoid FLOOD next time
-        self.mac_to_port[dpid][src] = in_port
-        self.logger.debug(f"[Learn] DPID={dpid} {src}->{in_port}")
-        # Determine the output port
+        known_port = mac_table.get(src)
+        mac_table[src] = in_port
+        if known_port != in_port and self._has_group_entries(dpid):
+            # The default group entries catch all IPv4 before it reaches the controller, so a
+            # learned host gets an L2 entry above them that lives as long as the MAC table entry
+            self.add_flow(datapath, PRIORITY_FLOW, parser.OFPMatch(eth_dst=src),
+                          [parser.OFPActionOutput(in_port)], idle=int(CONF.lb_mac_ttl), hard=0)
+        self.logger.debug("[Learn] DPID=%s %s->%s", dpid, src, in_port)
+        # Determine the output ports
+        # - out_ports: plain output ports (learned port, FLOOD, or downward ports)
+        # - uplink: uplink chosen by the selection policy, if any
+        # - use_group: hand the packet to the SELECT group instead of picking an uplink
+        # - covered: the switch's default group entry already handles this flow
+        out_ports, uplink, use_group, covered = [], None, False, False
         # If the destination MAC is known, use the learned port
-        if dst in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][dst]
+        learned_port = mac_table.get(dst)
+        ups = self.uplinks.get(dpid, ())
+        if (learned_port in ups and in_port not in ups and len(ups) > 1
+                and hdr.ethertype == ether_types.ETH_TYPE_IP):
+            # A remote host is learned behind one uplink, but any uplink reaches it,
+            # so new flows from below are still balanced after learning
+            if self.use_groups:
+                use_group = True
+            else:
+                uplink = self._select_uplink(dpid, in_port)
+        elif learned_port is not None:
+            out_ports = [learned_port]
+        elif self.topology == 'discover':
+            # Unknown destination in a discovered topology: go down towards hosts, never
+            # back up; traffic from below is also sent up one balanced uplink (up/down
+            # forwarding is loop-free in a fat-tree without needing a spanning tree)
+            out_ports = [p for p in self.local_ports.get(dpid, ()) if p != in_port]
+            if ups and in_port not in ups:
+                if self.use_groups:
+                    use_group = True
+                else:
+                    uplink = self._select_uplink(dpid, in_port)
         else:
             # If destination MAC is unknown, apply Round Robin for aggregation switches
-            # How does Round Robin work here? It cycles through the available uplink ports for each new flow to balance the load.
+            # How does Round Robin work here? It cycles through the available uplink ports for each new flow to balance the load
+            # (lb_policy=rr); least_loaded and p2c use the utilization measured by the monitor thread instead.
             # Which switches use Round Robin? Only aggregation switches (s2, s4) use Round Robin; others flood unknown destinations.
             # Identify aggregation switches by their DPID
-            if dpid in [2, 4]:  # aggregation switches
-                uplink_ports = [1, 2]
-                # Get the current counter for this switch
-                counter = self.rr_counter[dpid]
-                # Select the uplink port in a round-robin manner
-                out_port = uplink_ports[counter % len(uplink_ports)]
-                # Update the counter for the next flow
-                self.rr_counter[dpid] += 1
-                self.logger.info(f"[RR] Switch={dpid} selected uplink={out_port}")
+            if dpid in self.uplinks and self.use_groups:
+                # The SELECT group picks the uplink in the switch; only packets that
+                # raced the group installation (or are not IPv4) end up here
+                use_group, covered = True, len(self.uplinks[dpid]) > 1
+            elif dpid in self.uplinks:
+                # Select the uplink port according to the configured policy
+                uplink = self._select_uplink(dpid, in_port)
             else:
                 # For other switches, flood the packet
-                out_port = ofproto.OFPP_FLOOD
+                out_ports = [ofproto.OFPP_FLOOD]
 
-        # Create action to output the packet to the selected port
-        actions = [parser.OFPActionOutput(out_port)]
+        # Create actions to output the packet to the selected ports (and/or the SELECT group)
+        actions = [parser.OFPActionOutput(port) for port in out_ports]
+        if uplink is not None:
+            actions.append(parser.OFPActionOutput(uplink))
+        if use_group:
+            actions.append(parser.OFPActionGroup(self._uplink_group(dpid, in_port)))
+        if not actions:
+            # Nowhere to send it (e.g. arrived from above at a switch with no other ports)
+            return
 
         # Install a flow to avoid future packet_in events for this flow
-        if eth.ethertype == ether_types.ETH_TYPE_IP:
-            # Match on IPv4 src and dst addresses
+        # Group-balanced flows are already covered by the switch's default IPv4 entry
+        buffered = msg.buffer_id != ofproto.OFP_NO_BUFFER
+        flow_installed = False
+        if hdr.ethertype == ether_types.ETH_TYPE_IP and not covered:
+            # Match on IPv4 src and dst addresses, plus L4 ports depending on lb_match
             # Why not IPv6? This implementation focuses on IPv4 traffic; IPv6 handling can be added similarly if needed.
-            ip_pkt = pkt.get_protocol(ipv4.ipv4)
-            match = parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IP,
-                                    ipv4_src=ip_pkt.src, ipv4_dst=ip_pkt.dst)
-            # Why priority 1? This flow entry is for known flows and should have higher priority than table-miss entries.
-            self.add_flow(datapath, 1, match, actions)
-            self.logger.debug(f"[IPv4 Flow] {ip_pkt.src}->{ip_pkt.dst} via port {out_port}")
+            match, priority = self._build_match(parser, dpid, hdr)
+            # Why PRIORITY_FLOW/PRIORITY_MICROFLOW? These entries are for known flows and must win over both
+            # the table-miss entry and the SELECT group default entry; 5-tuple entries win over host pairs.
+            # If the switch buffered the packet, the FlowMod also forwards it, so no PacketOut is needed.
+            self.add_flow(datapath, priority, match, actions,
+                          buffer_id=msg.buffer_id if buffered else None,
+                          flags=ofproto.OFPFF_SEND_FLOW_REM)
+            flow_installed = True
+            if priority == PRIORITY_MICROFLOW:
+                # A set, not a counter: re-adding an identical match replaces the entry
+                # without a FLOW_REMOVED, so it must not be counted twice
+                self.microflows.setdefault(dpid, set()).add(self._match_key(match))
+            # Remember balanced placements so elephants can be moved later
+            if uplink is not None:
+                self._placement_table(dpid)[self._match_key(match)] = [match, priority, uplink, out_ports, 0.0, in_port]
+            self.logger.debug("[IPv4 Flow] %s->%s via ports %s uplink %s", hdr.ip_src, hdr.ip_dst, out_ports, uplink)
+
+        if flow_installed and buffered:
+            return
+        if not buffered and len(msg.data) < msg.total_len:
+            # Truncated and not buffered (the switch ran out of buffers): re-sending the
+            # partial frame would corrupt it, so drop it and let the sender retransmit
+            self.logger.debug("[Truncated] DPID=%s %d of %d bytes, not forwarded", dpid, len(msg.data), msg.total_len)
+            return
 
         # Send the packet out
-        data = None if msg.buffer_id != ofproto.OFP_NO_BUFFER else msg.data
+        data = None if buffered else msg.data
         out = parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
                                   in_port=in_port, actions=actions, data=data)
         datapath.send_msg(out)
+        self.metrics.inc('lb_packet_out_total', (('dpid', dpid),))
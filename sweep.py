@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep runner (Lab 2)
+------------------------------
+Runs experiment.py over the cross product of a JSON config, one cell per
+combination. Every cell gets its own directory, its own rr_lb.py
+controller and its own Mininet network. Finished cells are recorded in
+manifest.jsonl, so an interrupted sweep resumes where it stopped.
+
+Config keys:
+  out        output directory (cells go in <out>/<cell name>/)
+  parallel   cells run at once (default 1)
+  grid       parameter -> list of values; every combination is one cell
+  fixed      parameters shared by all cells
+  timeout_s  optional wall-clock limit per cell
+
+Parameters starting with lb_ go to the cell's controller config (lb.conf).
+All other parameters become experiment.py flags: {"arrival": "poisson"}
+gives --arrival poisson, true gives a bare flag and a list gives several
+values. Parallel cells get separate OpenFlow/WSGI ports and node name
+prefixes so their networks do not collide.
+
+    sudo python3 sweep.py sweep.json
+    sudo python3 sweep.py sweep.json --parallel 2
+    python3 sweep.py sweep.json --status
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXPERIMENT = os.path.join(HERE, "experiment.py")
+CONTROLLER = os.path.join(HERE, "rr_lb.py")
+
+OF_PORT = 6653          # slot i uses OF_PORT + i
+WSAPI_PORT = 8080       # slot i uses WSAPI_PORT + i
+STOP_GRACE_S = 60       # time experiment.py gets to tear its network down after SIGTERM
+
+# -------------------------------
+# Config
+# -------------------------------
+def load_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    if "out" not in config:
+        raise ValueError(f"{path}: missing 'out' directory")
+    config.setdefault("grid", {})
+    config.setdefault("fixed", {})
+    return config
+
+def expand(config):
+    """Yields (cell name, params) for every grid combination, in a stable order."""
+    keys = list(config["grid"])
+    for values in itertools.product(*(config["grid"][k] for k in keys)):
+        params = dict(config["fixed"], **dict(zip(keys, values)))
+        yield cell_name(keys, values), params
+
+def cell_name(keys, values):
+    fmt = lambda v: "+".join(map(str, v)) if isinstance(v, list) else str(v)
+    return "_".join(f"{k}-{fmt(v)}" for k, v in zip(keys, values)) or "default"
+
+def split_params(params):
+    """Separates controller options (lb_*) from experiment.py parameters."""
+    lb = {k: v for k, v in params.items() if k.startswith("lb_")}
+    exp = {k: v for k, v in params.items() if not k.startswith("lb_")}
+    return lb, exp
+
+def experiment_args(params):
+    args = []
+    for key, value in params.items():
+        flag = "--" + key.replace("_", "-")
+        if value is True:
+            args.append(flag)
+        elif value is None or value is False:
+            continue
+        elif isinstance(value, list):
+            args += [flag] + [str(v) for v in value]
+        else:
+            args += [flag, str(value)]
+    return args
+
+def write_controller_conf(path, lb):
+    with open(path, "w") as f:
+        f.write("[DEFAULT]\n")
+        for key, value in lb.items():
+            if isinstance(value, bool):
+                value = str(value).lower()
+            elif isinstance(value, list):
+                value = ",".join(map(str, value))
+            f.write(f"{key} = {value}\n")
+
+# -------------------------------
+# Manifest
+# -------------------------------
+class Manifest:
+    """Append-only record of finished cells; the last entry per cell wins."""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.cells = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.cells[entry["cell"]] = entry
+
+    def done(self, cell):
+        return self.cells.get(cell, {}).get("status") == "done"
+
+    def record(self, entry):
+        with self.lock:
+            self.cells[entry["cell"]] = entry
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+# -------------------------------
+# Cell execution
+# -------------------------------
+def wait_for_port(port, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+class Runner:
+    def __init__(self, config, parallel, ryu_manager):
+        self.config = config
+        self.out = config["out"]
+        self.manifest = Manifest(os.path.join(self.out, "manifest.jsonl"))
+        self.ryu_manager = ryu_manager
+        self.timeout = config.get("timeout_s")
+        self.slots = queue.SimpleQueue()
+        for slot in range(parallel):
+            self.slots.put(slot)
+        self.parallel = parallel
+        self.procs = set()
+        self.procs_lock = threading.Lock()
+        self.stopping = False
+
+    def _spawn(self, cmd, log, cwd):
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        with self.procs_lock:
+            self.procs.add(proc)
+        return proc
+
+    def _reap(self, proc, grace=10):
+        if proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        with self.procs_lock:
+            self.procs.discard(proc)
+
+    def run_cell(self, name, params):
+        if self.stopping:
+            return
+        slot = self.slots.get()
+        try:
+            self._run_cell(name, params, slot)
+        finally:
+            self.slots.put(slot)
+
+    def _run_cell(self, name, params, slot):
+        cell_dir = os.path.join(self.out, name)
+        os.makedirs(cell_dir, exist_ok=True)
+        lb, exp = split_params(params)
+        conf = os.path.join(cell_dir, "lb.conf")
+        write_controller_conf(conf, lb)
+        with open(os.path.join(cell_dir, "params.json"), "w") as f:
+            json.dump(params, f, indent=2)
+
+        of_port, wsapi_port = OF_PORT + slot, WSAPI_PORT + slot
+        ctl_cmd = [self.ryu_manager, "--config-file", conf,
+                   "--ofp-tcp-listen-port", str(of_port),
+                   "--wsapi-host", "127.0.0.1", "--wsapi-port", str(wsapi_port)]
+        if lb.get("lb_topology") == "discover":
+            ctl_cmd.append("--observe-links")
+        ctl_cmd.append(CONTROLLER)
+        exp_cmd = [sys.executable, EXPERIMENT] + experiment_args(exp) + \
+                  ["--controller-port", str(of_port), "--controller-wsapi-port", str(wsapi_port)]
+        if self.parallel > 1:
+            exp_cmd += ["--prefix", f"x{slot}"]
+
+        print(f"[Sweep] start {name} (slot {slot})")
+        t0 = time.monotonic()
+        status, rc = "failed", None
+        with open(os.path.join(cell_dir, "controller.log"), "w") as ctl_log, \
+             open(os.path.join(cell_dir, "experiment.log"), "w") as exp_log:
+            ctl = self._spawn(ctl_cmd, ctl_log, cell_dir)
+            try:
+                if not wait_for_port(of_port):
+                    print(f"[Sweep] {name}: controller did not come up on port {of_port}")
+                else:
+                    exp_proc = self._spawn(exp_cmd, exp_log, cell_dir)
+                    try:
+                        rc = exp_proc.wait(timeout=self.timeout)
+                        status = "done" if rc == 0 else "failed"
+                    except subprocess.TimeoutExpired:
+                        status = "timeout"
+                    finally:
+                        self._reap(exp_proc, STOP_GRACE_S)
+            finally:
+                self._reap(ctl)
+
+        if self.stopping:
+            # Interrupted cells are not recorded, so a resumed sweep reruns them
+            return
+        elapsed = time.monotonic() - t0
+        self.manifest.record({"cell": name, "status": status, "returncode": rc,
+                              "elapsed_s": round(elapsed, 1), "params": params,
+                              "finished": time.strftime("%Y-%m-%dT%H:%M:%S")})
+        print(f"[Sweep] {status} {name} in {elapsed:.0f}s")
+
+    def stop(self):
+        self.stopping = True
+        with self.procs_lock:
+            procs = list(self.procs)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+
+# -------------------------------
+# Main
+# -------------------------------
+def print_status(config, manifest):
+    cells = list(expand(config))
+    counts = {}
+    for name, _ in cells:
+        status = manifest.cells.get(name, {}).get("status", "pending")
+        counts[status] = counts.get(status, 0) + 1
+        print(f"{status:8s} {name}")
+    print("[Sweep] " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+          + f" of {len(cells)} cells")
+
+def main():
+    ap = argparse.ArgumentParser(description="Resumable parameter sweeps over experiment.py")
+    ap.add_argument("config", help="JSON sweep config")
+    ap.add_argument("--parallel", type=int, help="cells run at once (overrides the config)")
+    ap.add_argument("--status", action="store_true", help="show cell status and exit")
+    ap.add_argument("--ryu-manager", default="ryu-manager", help="ryu-manager executable")
+    args = ap.parse_args()
+
+    config = load_config(args.config)
+    os.makedirs(config["out"], exist_ok=True)
+    parallel = args.parallel or config.get("parallel", 1)
+    runner = Runner(config, parallel, args.ryu_manager)
+    if args.status:
+        print_status(config, runner.manifest)
+        return
+
+    # Keep the config next to its results
+    with open(os.path.join(config["out"], "sweep.json"), "w") as f:
+        json.dump(config, f, indent=2)
+
+    cells = list(expand(config))
+    todo = [(name, params) for name, params in cells if not runner.manifest.done(name)]
+    print(f"[Sweep] {len(cells)} cells, {len(cells) - len(todo)} already done, "
+          f"running {len(todo)} with {parallel} in parallel")
+
+    pool = ThreadPoolExecutor(max_workers=parallel)
+    futures = [pool.submit(runner.run_cell, name, params) for name, params in todo]
+    try:
+        for fut in futures:
+            fut.result()
+    except KeyboardInterrupt:
+        print("\n[Sweep] interrupted; unfinished cells will rerun on resume "
+              "(run 'sudo mn -c' if a network was left behind)")
+        runner.stop()
+        for fut in futures:
+            fut.cancel()
+    finally:
+        pool.shutdown(wait=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Network telemetry (Lab 2)
+-------------------------
+Samples the switches of a running Mininet network next to Experiment.run
+and attaches what each flow went through to its flow record.
+
+- counters: every `interval` seconds, per switch port, tx bytes and drops
+  from /sys/class/net (the file descriptors stay open and are re-read with
+  pread) and HTB backlog/drops from `tc -s -j qdisc show`
+- flows:    every `flow_interval` seconds, `ovs-ofctl dump-flows` of every
+  switch (IPv4 entries only: match, byte counter, output ports)
+
+Everything is stamped with time.monotonic_ns(), the clock of the start_ns /
+end_ns fields in flows.jsonl. stop() writes telemetry.npz (one row per
+sample, one column per port) and telemetry_flows.jsonl (flow table
+snapshots).
+
+join() follows each flow's path hop by hop: at every switch it picks the
+entry for the flow's src/dst IPs whose byte counter grew most during the
+flow, and follows its output port to the next switch. Each hop's
+utilization, peak queue backlog and drops over the flow's lifetime are
+added to the record.
+
+    python3 telemetry.py join flows.jsonl telemetry.npz telemetry_flows.jsonl -o flows_telemetry.jsonl
+"""
+
+import argparse
+import bisect
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from fct_stats import read_records
+
+_OUTPUT = re.compile(r"output:(\d+)")
+_GROUP = re.compile(r"group:(\d+)")
+_FIELD = re.compile(r"(n_bytes|priority|nw_src|nw_dst|tp_src|tp_dst)=([^,\s]+)")
+
+# -------------------------------
+# Sampler
+# -------------------------------
+class TelemetrySampler:
+    def __init__(self, net, interval=0.1, flow_interval=1.0, link_bps=20e6, prefix="",
+                 path="telemetry.npz", flows_path="telemetry_flows.jsonl"):
+        self.interval, self.flow_interval = interval, flow_interval
+        self.path, self.flows_path = path, flows_path
+        self.switches = [sw.name for sw in net.switches]
+        strip = lambda name: name[len(prefix):] if prefix and name.startswith(prefix) else name
+        self.strip = strip
+
+        # Switch ports ("s1:3", interface s1-eth3) and where each one leads ("s2" or "h1")
+        self.ports, hops, links, host_switch = [], [], {}, {}
+        for link in net.links:
+            for a, b in ((link.intf1, link.intf2), (link.intf2, link.intf1)):
+                if a.node.name in self.switches:
+                    hop = f"{strip(a.node.name)}:{a.node.ports[a]}"
+                    self.ports.append(a.name)
+                    hops.append(hop)
+                    links[hop] = strip(b.node.name)
+                    if b.node.name not in self.switches:
+                        host_switch[strip(b.node.name)] = strip(a.node.name)
+        self.meta = {"interval": interval, "flow_interval": flow_interval, "link_bps": link_bps,
+                     "switches": [strip(sw) for sw in self.switches], "links": links,
+                     "host_switch": host_switch,
+                     "hosts": {strip(h.name): h.IP() for h in net.hosts}, "ports": hops}
+
+        self._fds = []
+        for p in self.ports:
+            self._fds.append((os.open(f"/sys/class/net/{p}/statistics/tx_bytes", os.O_RDONLY),
+                              os.open(f"/sys/class/net/{p}/statistics/tx_dropped", os.O_RDONLY)))
+        self._col = {p: i for i, p in enumerate(self.ports)}
+        self.t, self.tx, self.drops, self.backlog, self.qdrops = [], [], [], [], []
+        self._tc = True
+        self._stop = threading.Event()
+        self._threads = [threading.Thread(target=self._sample_counters, daemon=True),
+                         threading.Thread(target=self._sample_flows, daemon=True)]
+        self._flows_file = None
+
+    def start(self):
+        self._flows_file = open(self.flows_path, "w")
+        for th in self._threads:
+            th.start()
+        print(f"[Telemetry] sampling {len(self.ports)} switch ports every {self.interval}s, "
+              f"flow tables every {self.flow_interval}s")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for th in self._threads:
+            th.join()
+        for fds in self._fds:
+            for fd in fds:
+                os.close(fd)
+        self._flows_file.close()
+        with open(self.path, "wb") as f:
+            np.savez_compressed(
+                f, t_ns=np.array(self.t, dtype=np.int64),
+                tx_bytes=np.array(self.tx, dtype=np.int64).reshape(-1, len(self.ports)),
+                tx_dropped=np.array(self.drops, dtype=np.int64).reshape(-1, len(self.ports)),
+                backlog_bytes=np.array(self.backlog, dtype=np.int64).reshape(-1, len(self.ports)),
+                qdisc_drops=np.array(self.qdrops, dtype=np.int64).reshape(-1, len(self.ports)),
+                meta=json.dumps(self.meta))
+        print(f"[Telemetry] {len(self.t)} samples written to {self.path}")
+
+    def _qdisc(self):
+        """Backlog and drops of each port's root qdisc, or None if tc -j is unavailable."""
+        if not self._tc:
+            return None
+        try:
+            out = subprocess.run(["tc", "-s", "-j", "qdisc", "show"], capture_output=True,
+                                 text=True, timeout=2).stdout
+            qdiscs = json.loads(out)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            print("[Telemetry] 'tc -s -j' not available, queue backlog is not sampled")
+            self._tc = False
+            return None
+        backlog, drops = [-1] * len(self.ports), [-1] * len(self.ports)
+        for q in qdiscs:
+            col = self._col.get(q.get("dev"))
+            # TCLink puts HTB at the root, with netem below it
+            if col is not None and q.get("root"):
+                backlog[col], drops[col] = q.get("backlog", 0), q.get("drops", 0)
+        return backlog, drops
+
+    def _sample_counters(self):
+        next_t = time.monotonic()
+        while not self._stop.is_set():
+            t = time.monotonic_ns()
+            tx = [int(os.pread(fd_tx, 32, 0)) for fd_tx, _ in self._fds]
+            drops = [int(os.pread(fd_dr, 32, 0)) for _, fd_dr in self._fds]
+            q = self._qdisc()
+            self.t.append(t)
+            self.tx.append(tx)
+            self.drops.append(drops)
+            self.backlog.append(q[0] if q else [-1] * len(self.ports))
+            self.qdrops.append(q[1] if q else [-1] * len(self.ports))
+            next_t += self.interval
+            self._stop.wait(max(next_t - time.monotonic(), 0))
+
+    def _sample_flows(self):
+        while not self._stop.is_set():
+            t = time.monotonic_ns()
+            for sw in self.switches:
+                try:
+                    out = subprocess.run(["ovs-ofctl", "-O", "OpenFlow13", "dump-flows", sw],
+                                         capture_output=True, text=True, timeout=2).stdout
+                except (OSError, subprocess.TimeoutExpired):
+                    continue
+                for line in out.splitlines():
+                    entry = parse_flow_entry(line)
+                    if entry:
+                        entry.update(t_ns=t, switch=self.strip(sw))
+                        self._flows_file.write(json.dumps(entry) + "\n")
+            self._flows_file.flush()
+            self._stop.wait(self.flow_interval)
+
+def parse_flow_entry(line):
+    """Parses one IPv4 entry of `ovs-ofctl dump-flows`; None for anything else."""
+    if "nw_src=" not in line or " actions=" not in line:
+        return None
+    match, actions = line.split(" actions=", 1)
+    fields = dict(_FIELD.findall(match))
+    group = _GROUP.search(actions)
+    return {"nw_src": fields.get("nw_src"), "nw_dst": fields.get("nw_dst"),
+            "priority": int(fields.get("priority", 0)), "n_bytes": int(fields.get("n_bytes", 0)),
+            "match": match.split("priority=", 1)[-1].strip(),
+            "out": [int(p) for p in _OUTPUT.findall(actions)],
+            "group": int(group.group(1)) if group else None}
+
+# -------------------------------
+# Join
+# -------------------------------
+class Telemetry:
+    """Loaded telemetry.npz + flow snapshots, indexed for per-flow lookups."""
+    def __init__(self, path="telemetry.npz", flows_path="telemetry_flows.jsonl"):
+        with np.load(path) as z:
+            self.t = z["t_ns"]
+            self.tx, self.drops = z["tx_bytes"], z["tx_dropped"]
+            self.backlog, self.qdrops = z["backlog_bytes"], z["qdisc_drops"]
+            self.meta = json.loads(str(z["meta"]))
+        self.col = {p: i for i, p in enumerate(self.meta["ports"])}
+        self.switches = set(self.meta["switches"])
+        # Snapshots are one flow_interval apart, so an entry seen within one
+        # interval of the flow's start or end may still have carried it
+        self.slack = int(self.meta["flow_interval"] * 1e9)
+        # (switch, src ip, dst ip) -> match -> ([t_ns], [(n_bytes, out, group)])
+        self.entries = defaultdict(lambda: defaultdict(lambda: ([], [])))
+        with open(flows_path) as f:
+            for line in f:
+                e = json.loads(line)
+                times, snaps = self.entries[(e["switch"], e["nw_src"], e["nw_dst"])][e["match"]]
+                times.append(e["t_ns"])
+                snaps.append((e["n_bytes"], e["out"], e["group"]))
+
+    def _egress(self, switch, src_ip, dst_ip, start, end):
+        """Output port (or "group:N") of the entry that carried most bytes in [start, end]."""
+        best, best_bytes = None, -1
+        for times, snaps in self.entries.get((switch, src_ip, dst_ip), {}).values():
+            lo = bisect.bisect_left(times, start - self.slack)
+            hi = bisect.bisect_right(times, end + self.slack) - 1
+            if hi < lo:
+                continue        # entry did not exist while the flow ran
+            grown = snaps[hi][0] - snaps[lo][0]
+            if grown > best_bytes:
+                _, out, group = snaps[hi]
+                best = out[0] if out else (f"group:{group}" if group is not None else None)
+                best_bytes = grown
+        return best
+
+    def path(self, src, dst, start, end):
+        """Switch ports ("s1:3") the flow left through, from src's switch onwards."""
+        hosts, links = self.meta["hosts"], self.meta["links"]
+        src_ip, dst_ip = hosts.get(src), hosts.get(dst)
+        hops, switch = [], self.meta["host_switch"].get(src)
+        while switch in self.switches and len(hops) < len(self.switches):
+            port = self._egress(switch, src_ip, dst_ip, start, end)
+            if port is None:
+                break
+            hops.append(f"{switch}:{port}")
+            switch = links.get(hops[-1])
+        return hops
+
+    def hop_stats(self, hop, start, end):
+        """Utilization, peak backlog (bytes) and drops of a switch port during [start, end]."""
+        col = self.col.get(hop)
+        if col is None or not len(self.t):
+            return None
+        lo = max(np.searchsorted(self.t, start, side="right") - 1, 0)
+        hi = min(np.searchsorted(self.t, end, side="left"), len(self.t) - 1)
+        dt = (self.t[hi] - self.t[lo]) / 1e9
+        util = (self.tx[hi, col] - self.tx[lo, col]) * 8 / dt / self.meta["link_bps"] if dt > 0 else float("nan")
+        backlog = int(self.backlog[lo:hi + 1, col].max())
+        backlog = backlog if backlog >= 0 else None     # not sampled
+        drops = int(self.drops[hi, col] - self.drops[lo, col])
+        if self.qdrops[hi, col] >= 0 and self.qdrops[lo, col] >= 0:
+            drops += int(self.qdrops[hi, col] - self.qdrops[lo, col])
+        return float(util), backlog, drops
+
+    def annotate(self, record):
+        start, end = record.get("start_ns"), record.get("end_ns")
+        if start is None or end is None:
+            return record
+        hops = self.path(record["src"], record["dst"], start, end)
+        stats = [self.hop_stats(h, start, end) for h in hops]
+        record["path"] = hops
+        record["hop_util"] = [s[0] if s else None for s in stats]
+        record["hop_backlog_b"] = [s[1] if s else None for s in stats]
+        record["hop_drops"] = [s[2] if s else None for s in stats]
+        known = [s for s in stats if s]
+        record["max_util"] = max((s[0] for s in known), default=None)
+        record["max_backlog_b"] = max((s[1] for s in known if s[1] is not None), default=None)
+        record["path_drops"] = sum(s[2] for s in known) if known else None
+        return record
+
+def join(flows_path="flows.jsonl", path="telemetry.npz", flows_snap_path="telemetry_flows.jsonl",
+         out_path="flows_telemetry.jsonl"):
+    tel = Telemetry(path, flows_snap_path)
+    n = 0
+    with open(out_path, "w") as fout:
+        for record in read_records(flows_path):
+            fout.write(json.dumps(tel.annotate(record)) + "\n")
+            n += 1
+    print(f"[Telemetry] {n} flow records annotated in {out_path}")
+
+# -------------------------------
+# Main
+# -------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Lab 2 telemetry tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    j = sub.add_parser("join", help="attach path and congestion to flow records")
+    j.add_argument("flows", nargs="?", default="flows.jsonl")
+    j.add_argument("telemetry", nargs="?", default="telemetry.npz")
+    j.add_argument("snapshots", nargs="?", default="telemetry_flows.jsonl")
+    j.add_argument("-o", "--out", default="flows_telemetry.jsonl")
+    args = ap.parse_args()
+    join(args.flows, args.telemetry, args.snapshots, args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Traffic agent (Lab 2)
+---------------------
+Long-lived flow generator that runs inside a Mininet host, replacing one
+forked iperf client per flow and one iperf server per run.
+
+- sink:   accepts connections, reads until EOF, answers with one byte and
+          closes. One persistent sink per destination host.
+- source: reads flow requests as JSON lines on stdin
+          {"id": 7, "dst": "10.0.0.2", "port": 5101, "size": 35000}
+          and runs them on a pre-spawned pool of worker threads. Each flow
+          connects, sends exactly `size` bytes, half-closes and waits for the
+          sink's acknowledgement, so the FCT covers delivery of the last byte.
+          Completions are written to stdout as JSON lines
+          {"id": 7, "start_ns": ..., "end_ns": ..., "ok": true}
+          with time.monotonic_ns() timestamps (same clock as experiment.py;
+          Mininet hosts share the kernel clock).
+
+    python3 traffic_agent.py sink --port 5101
+    python3 traffic_agent.py source --workers 64
+"""
+
+import argparse
+import json
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+CHUNK = 64 * 1024
+_ZEROS = memoryview(bytes(CHUNK))
+
+# -------------------------------
+# Sink
+# -------------------------------
+class SinkHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        conn = self.request
+        buf = bytearray(CHUNK)
+        while conn.recv_into(buf):
+            pass
+        conn.sendall(b"\x01")
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 1024
+
+def run_sink(args):
+    with SinkServer(("0.0.0.0", args.port), SinkHandler) as server:
+        server.serve_forever()
+
+# -------------------------------
+# Source
+# -------------------------------
+def send_flow(dst, port, size):
+    """Runs one flow; returns (start_ns, end_ns)."""
+    start = time.monotonic_ns()
+    with socket.create_connection((dst, port)) as conn:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        remaining = size
+        while remaining:
+            n = min(remaining, CHUNK)
+            conn.sendall(_ZEROS[:n])
+            remaining -= n
+        conn.shutdown(socket.SHUT_WR)
+        if not conn.recv(1):
+            raise ConnectionError("sink closed without acknowledging")
+    return start, time.monotonic_ns()
+
+def worker(jobs, out, lock):
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        try:
+            start, end = send_flow(job["dst"], job["port"], job["size"])
+            result = {"id": job["id"], "start_ns": start, "end_ns": end, "ok": True}
+        except OSError as e:
+            result = {"id": job["id"], "ok": False, "error": str(e)}
+        line = json.dumps(result) + "\n"
+        with lock:
+            out.write(line)
+            out.flush()
+
+def run_source(args):
+    jobs, lock = queue.SimpleQueue(), threading.Lock()
+    # Pre-spawn the pool so no thread creation happens on the flow path
+    threads = [threading.Thread(target=worker, args=(jobs, sys.stdout, lock), daemon=True)
+               for _ in range(args.workers)]
+    for t in threads:
+        t.start()
+    for line in sys.stdin:
+        if line.strip():
+            jobs.put(json.loads(line))
+    # stdin closed: finish queued flows, then exit
+    for _ in threads:
+        jobs.put(None)
+    for t in threads:
+        t.join()
+
+# -------------------------------
+# Main
+# -------------------------------
+def main():
+    ap = argparse.ArgumentParser(description="Lab 2 traffic agent")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sink = sub.add_parser("sink", help="persistent receiver")
+    sink.add_argument("--port", type=int, default=5101)
+    sink.set_defaults(func=run_sink)
+    source = sub.add_parser("source", help="flow sender fed from stdin")
+    source.add_argument("--workers", type=int, default=64, help="concurrent flows")
+    source.set_defaults(func=run_source)
+    args = ap.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()